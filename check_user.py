@@ -3,6 +3,7 @@ from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 
 from database_setup import get_engine_from_env
+from user_records import find_unity_users, find_users_by_email, latest_unity_users, latest_users
 
 
 def _is_placeholder_secret(value: str | None) -> bool:
@@ -12,15 +13,14 @@ def _is_placeholder_secret(value: str | None) -> bool:
     return v == "YOUR_PASSWORD" or v == "change-me" or v.startswith("replace-")
 
 
-def _print_rows(title: str, rows: list[dict]) -> None:
+def _print_rows(title: str, rows: list[tuple]) -> None:
     print(f"\n=== {title} ({len(rows)} rows) ===")
     if not rows:
         return
-    # stable column order (as returned)
-    cols = list(rows[0].keys())
-    print(" | ".join(cols))
+    # stable column order (record field order)
+    print(" | ".join(rows[0]._fields))
     for r in rows:
-        print(" | ".join(str(r.get(c, "")) for c in cols))
+        print(" | ".join(str(v) for v in r))
 
 
 def main() -> int:
@@ -50,56 +50,16 @@ def main() -> int:
 
             # Prisma users table
             if email:
-                users_rs = conn.execute(
-                    text(
-                        """
-                        select id, email, password_hash, email_verified_at
-                        from users
-                        where lower(email) = :email
-                        limit 20
-                        """
-                    ),
-                    {"email": email},
-                )
+                users_rows = find_users_by_email(conn, email)
             else:
-                users_rs = conn.execute(
-                    text(
-                        """
-                        select id, email, password_hash, email_verified_at
-                        from users
-                        order by created_at desc nulls last
-                        limit 20
-                        """
-                    )
-                )
-            users_rows = [dict(r._mapping) for r in users_rs.fetchall()]
+                users_rows = latest_users(conn)
             _print_rows("users table", users_rows)
 
             # Legacy/admin unity_users table (seeded by create_admin.py)
             if username:
-                admin_rs = conn.execute(
-                    text(
-                        """
-                        select id, username, hashed_password, is_active
-                        from unity_users
-                        where lower(username) = :u
-                        limit 20
-                        """
-                    ),
-                    {"u": username},
-                )
+                admin_rows = find_unity_users(conn, username)
             else:
-                admin_rs = conn.execute(
-                    text(
-                        """
-                        select id, username, hashed_password, is_active
-                        from unity_users
-                        order by id desc
-                        limit 20
-                        """
-                    )
-                )
-            admin_rows = [dict(r._mapping) for r in admin_rs.fetchall()]
+                admin_rows = latest_unity_users(conn)
             _print_rows("unity_users table", admin_rows)
 
         return 0
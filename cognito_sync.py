@@ -0,0 +1,430 @@
+"""
+Reconcile the Cognito user pool into `unity_users` (models.User).
+
+How it works:
+1) `unity_users` is loaded once in keyset chunks (by id) into a username -> state map.
+2) Cognito `list_users` is split into prefix partitions on `sub` (`sub ^= "0"` ... `sub ^= "f"`,
+   or 256 two-character prefixes). `sub` is a lowercase UUID every user has, so the partitions
+   cover the pool exactly once whatever the email looks like. They are paged concurrently by COGNITO_SYNC_WORKERS threads sharing one boto3 client
+   (adaptive retries absorb ListUsers throttling).
+3) Each page is diffed against the map and only real changes are written, as one
+   `insert ... select from unnest(...) on conflict (username) do update` per page.
+4) Once every partition is complete, Cognito-managed rows the scan did not see are confirmed
+   one by one with admin_get_user and deactivated in batches only if the user is gone or
+   disabled.
+
+Ownership: rows created here carry an unusable password hash (`!cognito`). Only those rows
+are updated or deactivated; local accounts with a real hash (create_admin.py) are never touched.
+
+Checkpointing: after every page the partition's pagination token goes to
+`<COGNITO_SYNC_CHECKPOINT_DIR>/state.json` and the usernames seen to `seen-<n>.txt`. A rerun
+resumes from there; the checkpoint is cleared after a complete run. Dry runs checkpoint into a
+throwaway directory, so they never resume from, or leave behind, a real run's state.
+
+Safety: a user missing from the listing (deleted mid-scan, or a pool that changed under us) is
+never deactivated on that alone. Each candidate is looked up with admin_get_user (usernames and
+email aliases both resolve); only UserNotFoundException or Enabled=false deactivates it, any
+other error keeps it active. Users that map to no username are counted and reported.
+
+Local testing: point AWS_COGNITO_ENDPOINT_URL at a Cognito stand-in (moto_server,
+cognito-local), or pass any object with list_users/admin_get_user to sync().
+
+Usage:
+  pip install boto3
+  python cognito_sync.py
+
+Env:
+  AWS_COGNITO_REGION (or AWS_REGION), AWS_COGNITO_USER_POOL_ID   required
+  AWS_COGNITO_ENDPOINT_URL         optional endpoint override (local stand-in)
+  COGNITO_SYNC_WORKERS             concurrent partitions (default: 8)
+  COGNITO_SYNC_PARTITIONS          16 | 256 `sub` prefix partitions, or 1 for a single scan (default: 16)
+  COGNITO_SYNC_EXTRA_FILTER        optional extra filter, e.g. 'cognito:user_status = "CONFIRMED"'
+                                   (disables partitioning and deactivation; Cognito takes one filter)
+  COGNITO_SYNC_DB_CHUNK            rows per keyset chunk when loading unity_users (default: 50000)
+  COGNITO_SYNC_CHECKPOINT_DIR      default: ./.cognito_sync
+  COGNITO_SYNC_DRY_RUN             "1" to diff and report without writing
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, NamedTuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from database_setup import get_engine_from_env
+
+COGNITO_PASSWORD_SENTINEL = "!cognito"
+
+_HEX = "0123456789abcdef"
+_SEEN_FILE = re.compile(r"^seen-\d+\.txt$")
+
+
+class LocalUser(NamedTuple):
+    id: int
+    is_active: bool
+    managed: bool
+
+
+@dataclass
+class SyncStats:
+    seen: int = 0
+    inserted: int = 0
+    updated: int = 0
+    deactivated: int = 0
+    pages: int = 0
+    elapsed_s: float = 0.0
+    partitions_resumed: int = 0
+    unmapped: int = 0
+    notes: list[str] = field(default_factory=list)
+
+
+def _env_flag(name: str) -> bool:
+    return (os.getenv(name) or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _cognito_username(user: dict[str, Any]) -> str:
+    # cognito_auth.py signs users up with the lowercased email as username; prefer the email
+    # attribute so pools using email as an alias (UUID usernames) map the same way.
+    attrs = {a.get("Name"): a.get("Value") for a in user.get("Attributes") or []}
+    return str(attrs.get("email") or user.get("Username") or "").strip().lower()
+
+
+def load_local_users(engine, *, chunk: int = 50_000) -> dict[str, LocalUser]:
+    out: dict[str, LocalUser] = {}
+    last_id = 0
+    with engine.connect() as conn:
+        while True:
+            rows = conn.execute(
+                text(
+                    """
+                    select id, lower(username) as username, is_active, hashed_password = :sentinel as managed
+                    from unity_users
+                    where id > :last_id
+                    order by id
+                    limit :limit
+                    """
+                ),
+                {"last_id": last_id, "limit": chunk, "sentinel": COGNITO_PASSWORD_SENTINEL},
+            ).fetchall()
+            if not rows:
+                break
+            for r in rows:
+                out[r.username] = LocalUser(int(r.id), bool(r.is_active), bool(r.managed))
+            last_id = int(rows[-1].id)
+    return out
+
+
+class Checkpoint:
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.state_path = os.path.join(directory, "state.json")
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self.state_path, encoding="utf-8") as fh:
+                self.state: dict[str, Any] = json.load(fh)
+        except FileNotFoundError:
+            self.state = {}
+
+    def matches(self, signature: dict[str, Any]) -> bool:
+        return self.state.get("signature") == signature
+
+    def reset(self, signature: dict[str, Any]) -> None:
+        with self._lock:
+            self._remove_seen_locked()
+            self.state = {"signature": signature, "partitions": {}}
+            self._save_locked()
+
+    def partition(self, key: str) -> dict[str, Any]:
+        return dict(self.state.get("partitions", {}).get(key) or {})
+
+    def seen_path(self, index: int) -> str:
+        return os.path.join(self.directory, f"seen-{index}.txt")
+
+    def update(self, key: str, *, token: str | None, done: bool) -> None:
+        with self._lock:
+            self.state.setdefault("partitions", {})[key] = {"token": token, "done": done}
+            self._save_locked()
+
+    def _save_locked(self) -> None:
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(self.state, fh)
+        os.replace(tmp, self.state_path)
+
+    def _remove_seen_locked(self) -> None:
+        for name in os.listdir(self.directory):
+            if _SEEN_FILE.match(name):
+                os.remove(os.path.join(self.directory, name))
+
+    def clear(self) -> None:
+        # Only our own files: the directory may be shared (/tmp, ".") and is left in place.
+        with self._lock:
+            self._remove_seen_locked()
+            for path in (self.state_path, f"{self.state_path}.tmp"):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self.state = {}
+
+
+def _apply_page(engine, changes: list[tuple[str, bool]], *, dry_run: bool) -> None:
+    if not changes or dry_run:
+        return
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+                insert into unity_users (username, hashed_password, is_active)
+                select u, :sentinel, a
+                from unnest(cast(:usernames as text[]), cast(:actives as boolean[])) as t(u, a)
+                on conflict (username) do update
+                  set is_active = excluded.is_active
+                  where unity_users.hashed_password = :sentinel
+                    and unity_users.is_active is distinct from excluded.is_active
+                """
+            ),
+            {
+                "sentinel": COGNITO_PASSWORD_SENTINEL,
+                "usernames": [u for u, _ in changes],
+                "actives": [a for _, a in changes],
+            },
+        )
+
+
+def _confirm_gone(cognito, pool_id: str, username: str) -> bool | None:
+    """True if the user no longer exists or is disabled, False if still active, None if unknown."""
+    try:
+        user = cognito.admin_get_user(UserPoolId=pool_id, Username=username)
+    except Exception as e:
+        code = getattr(e, "response", {}).get("Error", {}).get("Code") or e.__class__.__name__
+        return True if code == "UserNotFoundException" else None
+    return not bool(user.get("Enabled", True))
+
+
+def _deactivate(engine, ids: list[int], *, batch: int = 5000) -> None:
+    for i in range(0, len(ids), batch):
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    """
+                    update unity_users set is_active = false
+                    where id = any(cast(:ids as integer[])) and is_active and hashed_password = :sentinel
+                    """
+                ),
+                {"ids": ids[i : i + batch], "sentinel": COGNITO_PASSWORD_SENTINEL},
+            )
+
+
+def sync(
+    engine,
+    cognito,
+    pool_id: str,
+    *,
+    workers: int = 8,
+    partitions: int = 16,
+    extra_filter: str = "",
+    checkpoint_dir: str = ".cognito_sync",
+    db_chunk: int = 50_000,
+    dry_run: bool = False,
+) -> SyncStats:
+    stats = SyncStats()
+    started = time.perf_counter()
+
+    local = load_local_users(engine, chunk=db_chunk)
+
+    if extra_filter or partitions <= 1:
+        parts = [("*", extra_filter)]
+    else:
+        prefixes = [a + b for a in _HEX for b in _HEX] if partitions >= 256 else list(_HEX)
+        parts = [(p, f'sub ^= "{p}"') for p in prefixes]
+
+    scratch = tempfile.TemporaryDirectory(prefix="cognito_sync_dry_") if dry_run else None
+    try:
+        ckpt = Checkpoint(scratch.name if scratch else checkpoint_dir)
+        _sync_partitions(engine, cognito, pool_id, local, parts, ckpt, stats, workers=workers,
+                         extra_filter=extra_filter, dry_run=dry_run)
+    finally:
+        if scratch is not None:
+            scratch.cleanup()
+    stats.elapsed_s = time.perf_counter() - started
+    return stats
+
+
+def _sync_partitions(
+    engine,
+    cognito,
+    pool_id: str,
+    local: dict[str, LocalUser],
+    partitions: list[tuple[str, str]],
+    ckpt: Checkpoint,
+    stats: SyncStats,
+    *,
+    workers: int,
+    extra_filter: str,
+    dry_run: bool,
+) -> None:
+    stats_lock = threading.Lock()
+    signature = {"pool": pool_id, "partitions": [k for k, _ in partitions], "filter": extra_filter}
+    if not ckpt.matches(signature):
+        ckpt.reset(signature)
+
+    def run_partition(index: int, key: str, flt: str) -> set[str]:
+        seen: set[str] = set()
+        state = ckpt.partition(key)
+        seen_path = ckpt.seen_path(index)
+        if state and not os.path.exists(seen_path):
+            # Token without its seen-list would under-count users; redo the partition.
+            state = {}
+        if state:
+            with open(seen_path, encoding="utf-8") as fh:
+                seen.update(line.strip() for line in fh if line.strip())
+            with stats_lock:
+                stats.partitions_resumed += 1
+            if state.get("done"):
+                return seen
+        token = state.get("token")
+
+        with open(seen_path, "a", encoding="utf-8") as seen_fh:
+            while True:
+                kwargs: dict[str, Any] = {"UserPoolId": pool_id, "Limit": 60}
+                if flt:
+                    kwargs["Filter"] = flt
+                if token:
+                    kwargs["PaginationToken"] = token
+                resp = cognito.list_users(**kwargs)
+
+                changes: list[tuple[str, bool]] = []
+                page_names: list[str] = []
+                unmapped = 0
+                for user in resp.get("Users") or []:
+                    username = _cognito_username(user)
+                    if not username:
+                        unmapped += 1
+                        continue
+                    active = bool(user.get("Enabled", True))
+                    page_names.append(username)
+                    current = local.get(username)
+                    if current is None:
+                        changes.append((username, active))
+                    elif current.managed and current.is_active != active:
+                        changes.append((username, active))
+
+                _apply_page(engine, changes, dry_run=dry_run)
+                if page_names:
+                    seen_fh.write("".join(f"{u}\n" for u in page_names))
+                    seen_fh.flush()
+                seen.update(page_names)
+
+                token = resp.get("PaginationToken")
+                ckpt.update(key, token=token, done=not token)
+                with stats_lock:
+                    stats.pages += 1
+                    stats.unmapped += unmapped
+                    inserted = sum(1 for u, _ in changes if u not in local)
+                    stats.inserted += inserted
+                    stats.updated += len(changes) - inserted
+                if not token:
+                    return seen
+
+    seen_all: set[str] = set()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        futures = [ex.submit(run_partition, i, key, flt) for i, (key, flt) in enumerate(partitions)]
+        for fut in futures:
+            seen_all |= fut.result()
+    stats.seen = len(seen_all)
+
+    candidates = [
+        (name, u.id) for name, u in local.items() if u.managed and u.is_active and name not in seen_all
+    ]
+    if candidates and not extra_filter:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+            verdicts = list(ex.map(lambda c: _confirm_gone(cognito, pool_id, c[0]), candidates))
+        deactivate_ids = [uid for (_, uid), gone in zip(candidates, verdicts) if gone]
+        still_there = sum(1 for gone in verdicts if gone is False)
+        unknown = sum(1 for gone in verdicts if gone is None)
+        if still_there:
+            stats.notes.append(f"{still_there} unlisted users still exist in the pool; kept active")
+        if unknown:
+            stats.notes.append(f"{unknown} unlisted users could not be checked (admin_get_user failed); kept active")
+        if deactivate_ids and not dry_run:
+            _deactivate(engine, deactivate_ids)
+        stats.deactivated = len(deactivate_ids)
+
+    if stats.unmapped:
+        stats.notes.append(f"{stats.unmapped} pool users have neither email nor username; not synced")
+    ckpt.clear()
+
+
+def main() -> int:
+    try:
+        import boto3  # type: ignore
+        from botocore.config import Config  # type: ignore
+    except Exception:
+        print("Missing boto3. Install: pip install boto3")
+        return 2
+
+    region = (os.getenv("AWS_COGNITO_REGION") or os.getenv("AWS_REGION") or "").strip()
+    pool_id = (os.getenv("AWS_COGNITO_USER_POOL_ID") or "").strip()
+    if not region or not pool_id:
+        print("[cognito_sync] Set AWS_COGNITO_REGION (or AWS_REGION) and AWS_COGNITO_USER_POOL_ID")
+        return 2
+
+    try:
+        engine, loaded_files = get_engine_from_env()
+        if loaded_files:
+            print(f"Loaded env from: {', '.join(loaded_files)}")
+    except Exception as e:
+        print(f"[cognito_sync] Failed to load DB env / create engine: {e.__class__.__name__}: {e}")
+        return 2
+
+    workers = max(1, int(os.getenv("COGNITO_SYNC_WORKERS") or "8"))
+    cognito = boto3.client(
+        "cognito-idp",
+        region_name=region,
+        endpoint_url=(os.getenv("AWS_COGNITO_ENDPOINT_URL") or "").strip() or None,
+        config=Config(retries={"mode": "adaptive", "max_attempts": 10}, max_pool_connections=workers * 2),
+    )
+
+    here = os.path.abspath(os.path.dirname(__file__))
+    try:
+        stats = sync(
+            engine,
+            cognito,
+            pool_id,
+            workers=workers,
+            partitions=int(os.getenv("COGNITO_SYNC_PARTITIONS") or "16"),
+            extra_filter=(os.getenv("COGNITO_SYNC_EXTRA_FILTER") or "").strip(),
+            checkpoint_dir=os.getenv("COGNITO_SYNC_CHECKPOINT_DIR") or os.path.join(here, ".cognito_sync"),
+            db_chunk=max(1000, int(os.getenv("COGNITO_SYNC_DB_CHUNK") or "50000")),
+            dry_run=_env_flag("COGNITO_SYNC_DRY_RUN"),
+        )
+    except SQLAlchemyError as e:
+        print(f"[cognito_sync] DB error (checkpoint kept): {e.__class__.__name__}: {e}")
+        return 1
+    except Exception as e:
+        print(f"[cognito_sync] Failed (checkpoint kept): {e.__class__.__name__}: {e}")
+        return 1
+
+    for note in stats.notes:
+        print(f"[cognito_sync] Note: {note}")
+    print(
+        f"[cognito_sync] seen={stats.seen} inserted={stats.inserted} updated={stats.updated} "
+        f"deactivated={stats.deactivated} pages={stats.pages} resumed_partitions={stats.partitions_resumed} "
+        f"elapsed={stats.elapsed_s:.1f}s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
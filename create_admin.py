@@ -4,11 +4,10 @@ import secrets
 import sys
 from dataclasses import dataclass
 
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy import insert, update
 
 from database_setup import get_engine_from_env
-from models import User
+from user_records import get_unity_user, unity_users
 
 
 @dataclass(frozen=True)
@@ -61,18 +60,19 @@ def main() -> None:
     username, password = _get_admin_credentials()
     hashed = hash_password_pbkdf2_sha256(password).to_storage_string()
 
-    with Session(engine) as session:
-        existing = session.execute(select(User).where(User.username == username)).scalar_one_or_none()
+    with engine.begin() as conn:
+        existing = get_unity_user(conn, username)
         if existing is None:
-            session.add(User(username=username, hashed_password=hashed, is_active=True))
-            session.commit()
+            conn.execute(insert(unity_users).values(username=username, hashed_password=hashed, is_active=True))
             print(f"Admin user created: {username}")
             return
 
         # Idempotent: update hash if user already exists
-        existing.hashed_password = hashed
-        existing.is_active = True
-        session.commit()
+        conn.execute(
+            update(unity_users)
+            .where(unity_users.c.id == existing.id)
+            .values(hashed_password=hashed, is_active=True)
+        )
         print(f"Admin user already existed; password reset: {username}")
 
 
@@ -0,0 +1,466 @@
+"""
+Streaming columnar export for analyst tables.
+
+Replaces ad-hoc "select * into memory / CSV" pulls of `unity_brain_interactions`,
+`plaid_transactions` and `user_savings_events`:
+
+- Rows are read through a server-side cursor (`stream_results`) in EXPORT_CHUNK_ROWS chunks,
+  converted to Arrow record batches and written out, so memory stays flat regardless of
+  table size.
+- Output is Hive-partitioned by date: `<EXPORT_DIR>/<table>/dt=YYYY-MM-DD/part-<utc ts>-<pid>-<rand>-<n>.parquet`
+  (or `.arrow` for Arrow IPC), readable by pyarrow.dataset, DuckDB, Spark, Athena.
+- Incremental: each table keeps a `(ts, id)` watermark in `<EXPORT_DIR>/_watermarks.json`.
+  Rows are read in native `(ts, id)` order, so an index on `(ts)` or `(ts, id)` drives the
+  scan and the first chunk streams without sorting the whole table. Rows newer than
+  now() - EXPORT_SAFETY_LAG_S are left for the next run, since transactions that commit late
+  can carry earlier timestamps.
+- Rows are read in windows of EXPORT_CHUNK_ROWS * EXPORT_COMMIT_CHUNKS, each its own short
+  read resumed from the last `(ts, id)`, so no snapshot is held for the whole export.
+- A commit follows every window: the open files are closed under temporary names, then the new watermark and the list of pending renames are saved in one atomic
+  write, and only then are the files renamed. A crash at any point either leaves the old
+  watermark with no published files, or the new watermark with renames that the next run
+  finishes before exporting anything. Either way no rows are duplicated or lost, and at most
+  EXPORT_COMMIT_CHUNKS chunks are redone.
+- Tables run in parallel (EXPORT_WORKERS threads, one DB connection each).
+
+Usage:
+  pip install pyarrow
+  python data_export.py
+
+Env (all optional):
+  EXPORT_DIR            output root (default: ./exports)
+  EXPORT_TABLES         comma list (default: all three)
+  EXPORT_FORMAT         parquet | arrow (default: parquet)
+  EXPORT_CHUNK_ROWS     rows per fetch / record batch (default: 50000)
+  EXPORT_WORKERS        tables exported concurrently (default: 3)
+  EXPORT_SAFETY_LAG_S   skip rows newer than this many seconds (default: 60)
+  EXPORT_MAX_OPEN_FILES open partition writers per table (default: 16)
+  EXPORT_COMMIT_CHUNKS  chunks per read window / commit (default: 20)
+  EXPORT_FULL           "1" to ignore stored watermarks and export everything
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Any
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from database_setup import get_engine_from_env
+
+
+@dataclass(frozen=True)
+class ExportTable:
+    name: str
+    # (column, arrow type name) in output order; see _arrow_type().
+    columns: tuple[tuple[str, str], ...]
+    # Monotonic-ish insert timestamp used for the incremental watermark.
+    watermark_column: str = "created_at"
+    # Column whose date picks the output partition.
+    partition_column: str = "created_at"
+    # SQL type of `id`, used to cast the keyset bound so `(ts, id)` comparisons stay index-friendly.
+    id_type: str = "uuid"
+
+
+TABLES: dict[str, ExportTable] = {
+    "unity_brain_interactions": ExportTable(
+        "unity_brain_interactions",
+        (
+            ("id", "string"),
+            ("created_at", "timestamp"),
+            ("kind", "string"),
+            ("source", "string"),
+            ("user_id", "string"),
+            ("request_id", "string"),
+            ("encrypted_payload", "json"),
+            ("meta", "json"),
+        ),
+        id_type="text",
+    ),
+    "plaid_transactions": ExportTable(
+        "plaid_transactions",
+        (
+            ("id", "string"),
+            ("user_id", "string"),
+            ("plaid_transaction_id", "string"),
+            ("amount", "decimal"),
+            ("currency", "string"),
+            ("name", "string"),
+            ("merchant_name", "string"),
+            ("category_primary", "string"),
+            ("category_detailed", "string"),
+            ("occurred_on", "date"),
+            ("created_at", "timestamp"),
+        ),
+        partition_column="occurred_on",
+    ),
+    "user_savings_events": ExportTable(
+        "user_savings_events",
+        (
+            ("id", "string"),
+            ("user_id", "string"),
+            ("event_kind", "string"),
+            ("monthly_savings", "int"),
+            ("title_yi", "string"),
+            ("category", "string"),
+            ("target_budget_key", "string"),
+            ("created_at", "timestamp"),
+        ),
+    ),
+}
+
+
+@dataclass
+class ExportConfig:
+    out_dir: str
+    tables: list[str]
+    fmt: str = "parquet"
+    chunk_rows: int = 50_000
+    workers: int = 3
+    safety_lag_s: int = 60
+    max_open_files: int = 16
+    commit_chunks: int = 20
+    full: bool = False
+
+    @classmethod
+    def from_env(cls, root: str) -> "ExportConfig":
+        tables = [t.strip() for t in (os.getenv("EXPORT_TABLES") or "").split(",") if t.strip()]
+        unknown = [t for t in tables if t not in TABLES]
+        if unknown:
+            raise RuntimeError(f"Unknown EXPORT_TABLES entries: {', '.join(unknown)}")
+        fmt = (os.getenv("EXPORT_FORMAT") or "parquet").strip().lower()
+        if fmt not in ("parquet", "arrow"):
+            raise RuntimeError("EXPORT_FORMAT must be 'parquet' or 'arrow'")
+        return cls(
+            out_dir=os.getenv("EXPORT_DIR") or os.path.join(root, "exports"),
+            tables=tables or list(TABLES.keys()),
+            fmt=fmt,
+            chunk_rows=max(1000, int(os.getenv("EXPORT_CHUNK_ROWS") or "50000")),
+            workers=max(1, int(os.getenv("EXPORT_WORKERS") or "3")),
+            safety_lag_s=max(0, int(os.getenv("EXPORT_SAFETY_LAG_S") or "60")),
+            max_open_files=max(1, int(os.getenv("EXPORT_MAX_OPEN_FILES") or "16")),
+            commit_chunks=max(1, int(os.getenv("EXPORT_COMMIT_CHUNKS") or "20")),
+            full=(os.getenv("EXPORT_FULL") or "").strip().lower() in ("1", "true", "yes", "on"),
+        )
+
+
+class WatermarkStore:
+    """
+    `{table: {"ts": iso8601, "id": str, "pending": [[tmp, final], ...]}}` in a JSON file,
+    replaced atomically on save. `pending` lists renames (relative to the store's directory)
+    that belong to the saved watermark and may not have happened yet; settle() finishes them.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.base = os.path.dirname(os.path.abspath(path))
+        self._lock = threading.Lock()
+
+    def _read(self) -> dict[str, Any]:
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                data = json.load(fh)
+            return data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            return {}
+
+    def _write(self, data: dict[str, Any]) -> None:
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, indent=2, sort_keys=True)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, self.path)
+
+    def get(self, table: str) -> tuple[datetime, str] | None:
+        with self._lock:
+            wm = self._read().get(table)
+        if not wm:
+            return None
+        return datetime.fromisoformat(wm["ts"]), str(wm["id"])
+
+    def set(self, table: str, ts: datetime, row_id: str, *, pending: list[tuple[str, str]] | None = None) -> None:
+        with self._lock:
+            data = self._read()
+            data[table] = {"ts": ts.isoformat(), "id": row_id}
+            if pending:
+                data[table]["pending"] = [[os.path.relpath(p, self.base) for p in pair] for pair in pending]
+            self._write(data)
+
+    def settle(self, table: str) -> int:
+        """Finish the renames recorded with the current watermark. Safe to repeat."""
+        with self._lock:
+            data = self._read()
+            entry = data.get(table) or {}
+            pending = entry.pop("pending", None)
+            if not pending:
+                return 0
+            for tmp, final in pending:
+                tmp, final = os.path.join(self.base, tmp), os.path.join(self.base, final)
+                if os.path.exists(tmp):
+                    if os.path.exists(final):
+                        # Never replace a published file: its rows are already behind a watermark.
+                        raise RuntimeError(f"Refusing to overwrite published export file {final}")
+                    os.replace(tmp, final)
+            self._write(data)
+            return len(pending)
+
+
+def _arrow_type(pa, kind: str):
+    return {
+        "string": pa.string(),
+        "json": pa.string(),
+        "int": pa.int64(),
+        "decimal": pa.decimal128(38, 9),
+        "date": pa.date32(),
+        "timestamp": pa.timestamp("us", tz="UTC"),
+    }[kind]
+
+
+class PartitionWriters:
+    """
+    Keeps at most `max_open` partition writers open (LRU). Files are written as `.<name>.tmp`;
+    take_finished() hands closed ones to the caller for publishing, discard() removes them.
+    """
+
+    def __init__(self, pa, schema, table_dir: str, *, fmt: str, run_id: str, max_open: int) -> None:
+        self._pa = pa
+        self._schema = schema
+        self._table_dir = table_dir
+        self._fmt = fmt
+        self._run_id = run_id
+        self._max_open = max_open
+        self._open: OrderedDict[str, Any] = OrderedDict()
+        self._seq = 0
+        self.finished: list[tuple[str, str]] = []  # (tmp_path, final_path)
+
+    def _new_writer(self, partition: str):
+        part_dir = os.path.join(self._table_dir, f"dt={partition}")
+        os.makedirs(part_dir, exist_ok=True)
+        self._seq += 1
+        ext = "parquet" if self._fmt == "parquet" else "arrow"
+        name = f"part-{self._run_id}-{self._seq:05d}.{ext}"
+        final = os.path.join(part_dir, name)
+        tmp = os.path.join(part_dir, f".{name}.tmp")
+        if self._fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            writer = pq.ParquetWriter(tmp, self._schema, compression="zstd")
+        else:
+            writer = self._pa.ipc.new_file(tmp, self._schema, options=self._pa.ipc.IpcWriteOptions(compression="zstd"))
+        return writer, tmp, final
+
+    def write(self, partition: str, batch) -> None:
+        slot = self._open.get(partition)
+        if slot is None:
+            while len(self._open) >= self._max_open:
+                self._close(next(iter(self._open)))
+            slot = self._open[partition] = self._new_writer(partition)
+        self._open.move_to_end(partition)
+        if self._fmt == "parquet":
+            slot[0].write_batch(batch)
+        else:
+            slot[0].write(batch)
+
+    def _close(self, partition: str) -> None:
+        writer, tmp, final = self._open.pop(partition)
+        writer.close()
+        self.finished.append((tmp, final))
+
+    def close_all(self) -> None:
+        for partition in list(self._open):
+            self._close(partition)
+
+    def take_finished(self) -> list[tuple[str, str]]:
+        done, self.finished = self.finished, []
+        return done
+
+    def discard(self) -> None:
+        for partition in list(self._open):
+            try:
+                self._close(partition)
+            except Exception:
+                pass
+        for tmp, _ in self.finished:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+        self.finished = []
+
+
+def _to_value(kind: str, v: Any) -> Any:
+    if v is None:
+        return None
+    if kind == "json":
+        return v if isinstance(v, str) else json.dumps(v, separators=(",", ":"), default=str)
+    if kind == "string":
+        return str(v)
+    return v
+
+
+_TMP_FILE = re.compile(r"^\.part-.*\.tmp$")
+
+
+def _remove_orphans(table_dir: str) -> int:
+    """Temp files not covered by a saved watermark belong to a crashed run; their rows are redone."""
+    removed = 0
+    if not os.path.isdir(table_dir):
+        return 0
+    for part in os.scandir(table_dir):
+        if not (part.is_dir() and part.name.startswith("dt=")):
+            continue
+        for f in os.scandir(part.path):
+            if _TMP_FILE.match(f.name):
+                os.remove(f.path)
+                removed += 1
+    return removed
+
+
+def _partition_key(v: Any) -> str:
+    if isinstance(v, datetime):
+        return v.astimezone(timezone.utc).date().isoformat() if v.tzinfo else v.date().isoformat()
+    if isinstance(v, date):
+        return v.isoformat()
+    return "unknown"
+
+
+def export_table(engine, spec: ExportTable, cfg: ExportConfig, watermarks: WatermarkStore, run_id: str) -> dict[str, Any]:
+    try:
+        import pyarrow as pa  # type: ignore
+    except Exception as e:
+        raise RuntimeError("Missing pyarrow. Install: pip install pyarrow") from e
+
+    schema = pa.schema([(col, _arrow_type(pa, kind)) for col, kind in spec.columns])
+    kinds = [kind for _, kind in spec.columns]
+    names = [col for col, _ in spec.columns]
+    wm_idx = names.index(spec.watermark_column)
+    id_idx = names.index("id")
+    part_idx = names.index(spec.partition_column)
+
+    table_dir = os.path.join(cfg.out_dir, spec.name)
+    recovered = watermarks.settle(spec.name)
+    orphans = _remove_orphans(table_dir)
+    if recovered or orphans:
+        print(f"[export] {spec.name}: finished {recovered} pending renames, removed {orphans} orphaned temp files")
+
+    since = None if cfg.full else watermarks.get(spec.name)
+    upper = datetime.now(timezone.utc) - timedelta(seconds=cfg.safety_lag_s)
+    wm = spec.watermark_column
+    window = cfg.chunk_rows * cfg.commit_chunks
+
+    def window_sql(after: tuple[datetime, str] | None):
+        where = [f"{wm} < :upper"]
+        if after is not None:
+            # Cast the bound, not the column, so the row comparison can use an index on (ts[, id]).
+            where.append(f"{wm} >= :since_ts and ({wm}, id) > (:since_ts, cast(:since_id as {spec.id_type}))")
+        return text(
+            f"select {', '.join(names)} from public.{spec.name} "
+            f"where {' and '.join(where)} order by {wm}, id limit :limit"
+        )
+
+    writers = PartitionWriters(pa, schema, table_dir, fmt=cfg.fmt, run_id=run_id, max_open=cfg.max_open_files)
+    rows_out = 0
+    files = 0
+    last: tuple[datetime, str] | None = since
+    chunks_since_commit = 0
+    started = time.perf_counter()
+
+    def commit() -> None:
+        nonlocal files, chunks_since_commit
+        writers.close_all()
+        pending = writers.take_finished()
+        # Watermark + pending renames first (one atomic write), then the renames themselves.
+        watermarks.set(spec.name, last[0], last[1], pending=pending)
+        files += watermarks.settle(spec.name)
+        chunks_since_commit = 0
+
+    try:
+        while True:
+            params: dict[str, Any] = {"upper": upper, "limit": window}
+            if last is not None:
+                params["since_ts"], params["since_id"] = last
+            # One short read per commit window: a single cursor over the whole table would hold
+            # one snapshot for hours and pin the xmin horizon, blocking vacuum everywhere.
+            window_rows = 0
+            with engine.connect() as conn:
+                result = conn.execution_options(stream_results=True, max_row_buffer=cfg.chunk_rows).execute(
+                    window_sql(last), params
+                )
+                for chunk in result.partitions(cfg.chunk_rows):
+                    columns = [[_to_value(kind, row[i]) for row in chunk] for i, kind in enumerate(kinds)]
+                    batch = pa.RecordBatch.from_arrays(
+                        [pa.array(col, type=schema.field(i).type) for i, col in enumerate(columns)], schema=schema
+                    )
+                    keys = [_partition_key(v) for v in columns[part_idx]]
+                    if keys[0] == keys[-1] and len(set(keys)) == 1:
+                        writers.write(keys[0], batch)
+                    else:
+                        groups: dict[str, list[int]] = {}
+                        for i, k in enumerate(keys):
+                            groups.setdefault(k, []).append(i)
+                        for k, idx in groups.items():
+                            writers.write(k, batch.take(pa.array(idx, type=pa.int32())))
+                    rows_out += len(chunk)
+                    window_rows += len(chunk)
+                    last = (chunk[-1][wm_idx], str(chunk[-1][id_idx]))
+                    chunks_since_commit += 1
+            if chunks_since_commit:
+                commit()
+            if window_rows < window:
+                break
+    except BaseException:
+        writers.discard()
+        raise
+
+    elapsed = time.perf_counter() - started
+    return {"table": spec.name, "rows": rows_out, "files": files, "elapsed_s": elapsed,
+            "rows_per_s": rows_out / elapsed if elapsed > 0 else 0.0}
+
+
+def main() -> int:
+    try:
+        cfg = ExportConfig.from_env(os.path.abspath(os.path.dirname(__file__)))
+        engine, loaded_files = get_engine_from_env()
+        if loaded_files:
+            print(f"Loaded env from: {', '.join(loaded_files)}")
+    except Exception as e:
+        print(f"[export] Failed to load config / create engine: {e.__class__.__name__}: {e}")
+        return 2
+
+    os.makedirs(cfg.out_dir, exist_ok=True)
+    watermarks = WatermarkStore(os.path.join(cfg.out_dir, "_watermarks.json"))
+    # pid + random suffix: back-to-back runs in the same second must not reuse file names.
+    run_id = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{os.getpid()}-{secrets.token_hex(3)}"
+
+    failed = False
+    with ThreadPoolExecutor(max_workers=min(cfg.workers, len(cfg.tables))) as pool:
+        futures = {name: pool.submit(export_table, engine, TABLES[name], cfg, watermarks, run_id) for name in cfg.tables}
+        for name, fut in futures.items():
+            try:
+                r = fut.result()
+                print(
+                    f"[export] {name}: rows={r['rows']} files={r['files']} "
+                    f"rate={r['rows_per_s']:.0f} rows/s elapsed={r['elapsed_s']:.1f}s"
+                )
+            except SQLAlchemyError as e:
+                failed = True
+                print(f"[export] {name}: DB error: {e.__class__.__name__}: {e}")
+            except Exception as e:
+                failed = True
+                print(f"[export] {name}: failed: {e.__class__.__name__}: {e}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
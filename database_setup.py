@@ -39,14 +39,14 @@ def _is_placeholder_secret(value: str | None) -> bool:
     v = value.strip()
     return v == "YOUR_PASSWORD" or v == "change-me" or v.startswith("replace-")
 
-def _resolve_password_interactively_if_needed() -> None:
+def _resolve_password_interactively_if_needed(*, interactive: bool = True) -> None:
     """
     Ensure DB_PASSWORD is available.
 
     Resolution order:
     1) DB_PASSWORD (if non-placeholder)
     2) DB_PASSWORD_B64 (base64-encoded UTF-8 password)
-    3) Interactive prompt (if running in a real terminal)
+    3) Interactive prompt (if running in a real terminal and `interactive` is set)
     """
     current = os.getenv("DB_PASSWORD")
     if not _is_placeholder_secret(current):
@@ -63,7 +63,7 @@ def _resolve_password_interactively_if_needed() -> None:
             # fall through to prompt / error
             pass
 
-    if sys.stdin is not None and sys.stdin.isatty():
+    if interactive and sys.stdin is not None and sys.stdin.isatty():
         pw = getpass.getpass("Enter DB_PASSWORD for AWS RDS: ")
         if pw and not _is_placeholder_secret(pw):
             os.environ["DB_PASSWORD"] = pw
@@ -75,10 +75,16 @@ def _resolve_password_interactively_if_needed() -> None:
     )
 
 
-def get_engine_from_env():
+def get_engine_from_env(*, keep_warm: bool = False, interactive: bool = True):
     """
     Load local env vars (if present), ensure a real DB password exists, and return a SQLAlchemy engine.
 
+    keep_warm=True (long-running processes) opens a minimum number of connections up front and
+    validates idle ones from a background thread instead of pinging on every checkout.
+    See pool_keeper.py for the DB_POOL_* settings.
+
+    interactive=False never prompts for DB_PASSWORD (servers, background threads).
+
     Returns:
       (engine, loaded_files)
     """
@@ -89,7 +95,19 @@ def get_engine_from_env():
         # Ignore placeholder DATABASE_URL and rely on DB_* pieces instead.
         os.environ.pop("DATABASE_URL", None)
 
-    _resolve_password_interactively_if_needed()
+    _resolve_password_interactively_if_needed(interactive=interactive)
+    if keep_warm:
+        from pool_keeper import pool_settings_from_env, start_pool_keeper
+
+        settings = pool_settings_from_env()
+        engine = create_db_engine(
+            pre_ping=False,
+            pool_size=int(settings["pool_size"]),
+            # Backstop only; the keeper retires connections at max_lifetime_s.
+            pool_recycle=int(settings["max_lifetime_s"] * 2),
+        )
+        start_pool_keeper(engine, settings)
+        return engine, loaded_files
     return create_db_engine(), loaded_files
 
 
@@ -119,12 +137,13 @@ def get_database_url() -> str:
     return f"postgresql+psycopg2://{user}:{quote_plus(password)}@{host}:{port}/{dbname}"
 
 
-def create_db_engine():
+def create_db_engine(*, pre_ping: bool = True, **engine_kwargs):
     database_url = get_database_url()
     return create_engine(
         database_url,
-        pool_pre_ping=True,
+        pool_pre_ping=pre_ping,
         connect_args={"connect_timeout": 10},
+        **engine_kwargs,
     )
 
 
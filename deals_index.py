@@ -0,0 +1,405 @@
+"""
+In-memory merchant index over `unity_deals_library`.
+
+Matching a transaction merchant to a deal/benchmark used to mean an `eq`/LIKE query per
+merchant. This module loads active rows once and answers lookups from memory:
+
+- exact: `merchant_norm` -> row ids (hash lookup)
+- fuzzy: trigram inverted index, scored with the same similarity as pg_trgm
+  (shared / (|a| + |b| - shared), default threshold 0.3)
+- per-category array of deal ids sorted by saving_pct (best first)
+
+Refresh is incremental: rows are pulled in keyset order by `(updated_at, id)` from the last
+seen watermark minus DEALS_INDEX_SAFETY_LAG_S (default 60), because `updated_at = now()` is the
+writer's transaction start and a row can commit after a pull with an earlier timestamp.
+Re-applying the overlap is idempotent. Rows that became inactive are dropped; hard deletes
+are only picked up by the periodic full rebuild.
+
+Fuzzy lookups count trigram hits over the selective postings (those in at most 1% of rows),
+keep rows that can still reach the threshold, and score at most 2000 of them outside the
+index lock.
+
+Usage:
+  python deals_index.py                          # load from DB and benchmark matches/s
+  DEALS_BENCH_SYNTHETIC=200000 python deals_index.py   # benchmark without a DB
+
+`main.py` serves this index at `/deals/match` when started with DEALS_INDEX_ENABLED=1.
+"""
+
+from __future__ import annotations
+
+import bisect
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Iterable, NamedTuple
+
+
+_NON_ALNUM = re.compile(r"[^a-z0-9\s]")
+_WS = re.compile(r"\s+")
+
+DEFAULT_THRESHOLD = 0.3
+_REFRESH_CHUNK = 5000
+# Trigrams in more than this share of rows ("  s", " 1", "ing") are useless for narrowing the
+# candidate set; fuzzy lookups skip their postings (floor for small indexes).
+_MAX_DF_RATIO = 0.01
+_MIN_DF_CUTOFF = 200
+_MAX_CANDIDATES = 2000
+_ZERO_UUID = "00000000-0000-0000-0000-000000000000"
+
+
+def normalize_merchant(value: str) -> str:
+    # Mirrors normalizeMerchant() in lib/unity-deals-library.ts so keys line up with stored merchant_norm.
+    s = _NON_ALNUM.sub(" ", str(value or "").lower())
+    return _WS.sub(" ", s).strip()[:80]
+
+
+def trigrams(norm: str) -> frozenset[str]:
+    # pg_trgm style: each word padded with two leading spaces and one trailing space.
+    out: set[str] = set()
+    for word in norm.split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            out.add(padded[i : i + 3])
+    return frozenset(out)
+
+
+class DealRow(NamedTuple):
+    id: str
+    kind: str
+    category: str
+    merchant: str
+    merchant_norm: str
+    saving_pct: float | None
+    avg_monthly_price: float | None
+    sample_count: int
+    updated_at: datetime | None
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "category": self.category,
+            "merchant": self.merchant,
+            "merchant_norm": self.merchant_norm,
+            "saving_pct": self.saving_pct,
+            "avg_monthly_price": self.avg_monthly_price,
+            "sample_count": self.sample_count,
+        }
+
+
+def _row_from_mapping(m: Any) -> DealRow:
+    return DealRow(
+        id=str(m["id"]),
+        kind=str(m["kind"]),
+        category=str(m["category"]),
+        merchant=str(m["merchant"]),
+        merchant_norm=str(m["merchant_norm"]),
+        saving_pct=float(m["saving_pct"]) if m["saving_pct"] is not None else None,
+        avg_monthly_price=float(m["avg_monthly_price"]) if m["avg_monthly_price"] is not None else None,
+        sample_count=int(m["sample_count"] or 0),
+        updated_at=m["updated_at"],
+    )
+
+
+class DealsIndex:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._rows: dict[str, DealRow] = {}
+        self._trigrams: dict[str, frozenset[str]] = {}
+        self._by_norm: dict[str, set[str]] = {}
+        self._postings: dict[str, set[str]] = {}
+        # category -> sorted list of (-saving_pct, id) for kind='deal'
+        self._by_category: dict[str, list[tuple[float, str]]] = {}
+        self.watermark: tuple[datetime, str] | None = None
+        self.loaded_at: float = 0.0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    # --- mutation -------------------------------------------------------------------------
+
+    def _remove_locked(self, row_id: str) -> None:
+        row = self._rows.pop(row_id, None)
+        if row is None:
+            return
+        ids = self._by_norm.get(row.merchant_norm)
+        if ids is not None:
+            ids.discard(row_id)
+            if not ids:
+                del self._by_norm[row.merchant_norm]
+        for tg in self._trigrams.pop(row_id, frozenset()):
+            posting = self._postings.get(tg)
+            if posting is not None:
+                posting.discard(row_id)
+                if not posting:
+                    del self._postings[tg]
+        if row.kind == "deal" and row.saving_pct is not None:
+            arr = self._by_category.get(row.category)
+            if arr:
+                key = (-row.saving_pct, row_id)
+                i = bisect.bisect_left(arr, key)
+                if i < len(arr) and arr[i] == key:
+                    del arr[i]
+
+    def _add_locked(self, row: DealRow) -> None:
+        self._rows[row.id] = row
+        self._by_norm.setdefault(row.merchant_norm, set()).add(row.id)
+        tgs = trigrams(row.merchant_norm)
+        self._trigrams[row.id] = tgs
+        for tg in tgs:
+            self._postings.setdefault(tg, set()).add(row.id)
+        if row.kind == "deal" and row.saving_pct is not None:
+            bisect.insort(self._by_category.setdefault(row.category, []), (-row.saving_pct, row.id))
+
+    def apply(self, rows: Iterable[tuple[DealRow, bool]]) -> int:
+        """Upsert (row, active) pairs; inactive rows are removed. Returns the number applied."""
+        n = 0
+        with self._lock:
+            for row, active in rows:
+                self._remove_locked(row.id)
+                if active:
+                    self._add_locked(row)
+                if row.updated_at is not None:
+                    mark = (row.updated_at, row.id)
+                    if self.watermark is None or mark > self.watermark:
+                        self.watermark = mark
+                n += 1
+            self.loaded_at = time.time()
+        return n
+
+    # --- queries --------------------------------------------------------------------------
+
+    def match(
+        self,
+        merchant: str,
+        *,
+        kind: str | None = None,
+        category: str | None = None,
+        limit: int = 3,
+        threshold: float = DEFAULT_THRESHOLD,
+    ) -> list[tuple[DealRow, float]]:
+        norm = normalize_merchant(merchant)
+        if not norm:
+            return []
+
+        def keep(row: DealRow) -> bool:
+            return (kind is None or row.kind == kind) and (category is None or row.category == category)
+
+        with self._lock:
+            exact = [self._rows[i] for i in self._by_norm.get(norm, ())]
+        exact = [r for r in exact if keep(r)]
+        if exact:
+            exact.sort(key=lambda r: -(r.saving_pct or 0.0))
+            return [(r, 1.0) for r in exact[:limit]]
+
+        q = trigrams(norm)
+        if not q:
+            return []
+        qn = len(q)
+        # A row reaching `threshold` shares at least ceil(threshold * |q|) trigrams with q.
+        # Hits are counted over the selective postings only; a near-universal trigram
+        # ("  s", " 1", "ing") could add at most one hit each, so it lowers the bar instead.
+        need = max(1, math.ceil(threshold * qn))
+        with self._lock:
+            max_df = max(_MIN_DF_CUTOFF, int(len(self._rows) * _MAX_DF_RATIO))
+            postings = sorted((self._postings.get(tg, ()) for tg in q), key=len)
+            selective = [p for p in postings if len(p) <= max_df] or postings[:1]
+            hits: Counter[str] = Counter()
+            for posting in selective:
+                hits.update(posting)
+            min_hits = max(1, need - (qn - len(selective)))
+            candidates = [row_id for row_id, n in hits.most_common(_MAX_CANDIDATES) if n >= min_hits]
+            # Rows and trigram sets are immutable; grab references and score without the lock.
+            snapshot = [(self._trigrams[i], self._rows[i]) for i in candidates]
+
+        scored: list[tuple[float, float, DealRow]] = []
+        for row_tgs, row in snapshot:
+            common = len(q & row_tgs)
+            sim = common / (qn + len(row_tgs) - common)
+            if sim >= threshold and keep(row):
+                scored.append((sim, row.saving_pct or 0.0, row))
+
+        scored.sort(key=lambda t: (-t[0], -t[1]))
+        return [(row, round(sim, 4)) for sim, _, row in scored[:limit]]
+
+    def match_many(self, merchants: list[str], **kwargs: Any) -> list[list[tuple[DealRow, float]]]:
+        return [self.match(m, **kwargs) for m in merchants]
+
+    def top_deals(self, category: str, n: int = 5) -> list[DealRow]:
+        with self._lock:
+            arr = self._by_category.get(category) or []
+            return [self._rows[row_id] for _, row_id in arr[: max(0, n)]]
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "rows": len(self._rows),
+                "merchant_norms": len(self._by_norm),
+                "trigrams": len(self._postings),
+                "categories": {c: len(a) for c, a in self._by_category.items()},
+                "watermark": self.watermark[0].isoformat() if self.watermark else None,
+                "loaded_at": self.loaded_at,
+            }
+
+    # --- DB loading -----------------------------------------------------------------------
+
+    def refresh(self, engine, *, full: bool = False, safety_lag_s: float = 60.0) -> int:
+        """
+        Pull changed rows in keyset chunks. A full rebuild loads active rows into a fresh
+        index and swaps it in, so readers never see a half-built state.
+        """
+        from sqlalchemy import text
+
+        if full:
+            fresh = DealsIndex()
+            n = fresh._pull(engine, text, since=None, active_only=True)
+            with self._lock, fresh._lock:
+                self.__dict__.update({k: v for k, v in fresh.__dict__.items() if k != "_lock"})
+            return n
+        since = None
+        if self.watermark is not None:
+            since = (self.watermark[0] - timedelta(seconds=safety_lag_s), _ZERO_UUID)
+        return self._pull(engine, text, since=since, active_only=False)
+
+    def _pull(self, engine, text, *, since: tuple[datetime, str] | None, active_only: bool) -> int:
+        cols = "id, kind, category, merchant, merchant_norm, saving_pct, avg_monthly_price, sample_count, updated_at, active"
+        total = 0
+        with engine.connect() as conn:
+            while True:
+                where = ["active"] if active_only else []
+                params: dict[str, Any] = {"limit": _REFRESH_CHUNK}
+                if since is not None:
+                    where.append("updated_at >= :since_ts and (updated_at, id) > (:since_ts, cast(:since_id as uuid))")
+                    params["since_ts"], params["since_id"] = since
+                sql = (
+                    f"select {cols} from public.unity_deals_library"
+                    + (f" where {' and '.join(where)}" if where else "")
+                    + " order by updated_at, id limit :limit"
+                )
+                batch = [(_row_from_mapping(r._mapping), bool(r._mapping["active"])) for r in conn.execute(text(sql), params)]
+                if not batch:
+                    break
+                total += self.apply(batch)
+                last = batch[-1][0]
+                since = (last.updated_at, last.id)
+                if len(batch) < _REFRESH_CHUNK:
+                    break
+        return total
+
+
+class DealsIndexRefresher:
+    """Background thread that keeps a DealsIndex warm: incremental pulls plus periodic full rebuilds."""
+
+    def __init__(
+        self,
+        index: DealsIndex,
+        engine,
+        *,
+        interval_s: float = 30.0,
+        full_every_s: float = 3600.0,
+        safety_lag_s: float = 60.0,
+    ) -> None:
+        self.index = index
+        self._safety_lag_s = safety_lag_s
+        self._engine = engine
+        self._interval_s = interval_s
+        self._full_every_s = full_every_s
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="deals-index-refresh", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        last_full = time.monotonic()
+        while not self._stop.wait(self._interval_s):
+            try:
+                if time.monotonic() - last_full >= self._full_every_s:
+                    self.index.refresh(self._engine, full=True)
+                    last_full = time.monotonic()
+                else:
+                    self.index.refresh(self._engine, safety_lag_s=self._safety_lag_s)
+            except Exception as e:
+                print(f"[deals_index] Refresh failed: {e.__class__.__name__}: {e}")
+
+
+def _synthetic_rows(n: int) -> list[tuple[DealRow, bool]]:
+    rng = random.Random(7)
+    # Merchant vocabularies are wide; a small word pool would make every trigram a stop-gram.
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = ["".join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(max(1000, n // 4))]
+    cats = ["insurance", "phone", "utilities", "internet", "subscription", "other"]
+    out = []
+    for i in range(n):
+        merchant = f"{rng.choice(words)} {rng.choice(words)} {i}"
+        out.append(
+            (
+                DealRow(f"{i:032x}", "deal", rng.choice(cats), merchant, normalize_merchant(merchant),
+                        round(rng.random(), 3), None, 1, None),
+                True,
+            )
+        )
+    return out
+
+
+def benchmark(index: DealsIndex, *, queries: int = 20000) -> dict[str, float]:
+    rng = random.Random(11)
+    norms = list(index._by_norm.keys())
+    if not norms:
+        return {"exact_per_s": 0.0, "fuzzy_per_s": 0.0}
+    exact_q = [rng.choice(norms).upper() for _ in range(queries)]
+    # Drop one character to force the trigram path.
+    fuzzy_q = []
+    for _ in range(queries // 10 or 1):
+        s = rng.choice(norms)
+        j = rng.randrange(len(s))
+        fuzzy_q.append(s[:j] + s[j + 1 :])
+
+    t0 = time.perf_counter()
+    index.match_many(exact_q)
+    t1 = time.perf_counter()
+    index.match_many(fuzzy_q)
+    t2 = time.perf_counter()
+    return {
+        "exact_per_s": len(exact_q) / max(t1 - t0, 1e-9),
+        "fuzzy_per_s": len(fuzzy_q) / max(t2 - t1, 1e-9),
+    }
+
+
+def main() -> int:
+    index = DealsIndex()
+    synthetic = int(os.getenv("DEALS_BENCH_SYNTHETIC") or "0")
+    t0 = time.perf_counter()
+    if synthetic > 0:
+        index.apply(_synthetic_rows(synthetic))
+    else:
+        from database_setup import get_engine_from_env
+
+        try:
+            engine, loaded_files = get_engine_from_env()
+            if loaded_files:
+                print(f"Loaded env from: {', '.join(loaded_files)}")
+            index.refresh(engine, full=True)
+        except Exception as e:
+            print(f"[deals_index] Failed to load index: {e.__class__.__name__}: {e}")
+            return 1
+    load_s = time.perf_counter() - t0
+
+    st = index.stats()
+    print(f"[deals_index] rows={st['rows']} merchant_norms={st['merchant_norms']} trigrams={st['trigrams']} load={load_s:.2f}s")
+    result = benchmark(index)
+    print(f"[deals_index] exact: {result['exact_per_s']:.0f} matches/s, fuzzy: {result['fuzzy_per_s']:.0f} matches/s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,420 @@
+"""
+UnityCredit retention job for `email_logs` and `uc_email_otps`.
+
+Every OTP and every notification writes a row, so both tables grow without bound and their
+indexes bloat the hot insert/lookup paths. This job deletes expired OTPs and old email logs
+in small keyset-ordered batches, each in its own short transaction, so it never holds long
+locks on the live tables.
+
+Per batch:
+- `SET LOCAL lock_timeout` / `statement_timeout` bound how long we can block (or be blocked by)
+  live traffic. A lock timeout rolls the batch back and retries it after a back-off; a
+  statement timeout halves the batch size instead (retrying the same slow batch would just
+  time out again). Either gives up after RETENTION_MAX_RETRIES consecutive failures.
+- Rows are picked with `FOR UPDATE SKIP LOCKED`, so rows the app is touching are left alone.
+- The keyset cursor `(key, id)` resumes where the previous batch ended instead of re-walking
+  dead index entries left behind by earlier deletes.
+- With RETENTION_ARCHIVE_DIR set, deleted rows are written to gzip'd JSONL and flushed to disk
+  before the batch commits (a failed archive write rolls the delete back).
+
+Between batches the job sleeps RETENTION_SLEEP_MS and, if readable, waits while
+`pg_stat_replication` replay lag exceeds RETENTION_MAX_REPLICA_LAG_S.
+
+Usage:
+  python email_retention.py
+
+Env (all optional):
+  RETENTION_TABLES              comma list (default: email_logs,uc_email_otps)
+  RETENTION_EMAIL_LOGS_DAYS     delete sent/failed logs older than N days (default: 90)
+  RETENTION_OTP_GRACE_HOURS     delete OTPs expired more than N hours ago (default: 24)
+  RETENTION_BATCH_SIZE          rows per batch (default: 1000)
+  RETENTION_SLEEP_MS            pause between batches (default: 100)
+  RETENTION_LOCK_TIMEOUT_MS     per-batch lock_timeout (default: 2000)
+  RETENTION_STATEMENT_TIMEOUT_MS per-batch statement_timeout (default: 15000)
+  RETENTION_MAX_REPLICA_LAG_S   throttle above this replay lag; 0 disables (default: 10)
+  RETENTION_MAX_BATCHES         stop after N batches per table; 0 = no limit (default: 0)
+  RETENTION_MAX_RETRIES         consecutive timed-out batches before giving up (default: 10)
+  RETENTION_ARCHIVE_DIR         write deleted rows to <dir>/<table>-<ts>.jsonl.gz first
+  RETENTION_DRY_RUN             "1" to only count eligible rows
+  RETENTION_VACUUM              "1" to run a plain (non-blocking) VACUUM ANALYZE afterwards
+  RETENTION_REINDEX             "1" to REINDEX ... CONCURRENTLY the table's indexes afterwards
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+
+from database_setup import get_engine_from_env
+
+
+@dataclass(frozen=True)
+class RetentionTarget:
+    table: str
+    key_column: str
+    # Extra predicate (beyond key < cutoff) that must hold for a row to be deletable.
+    where: str = "true"
+
+
+TARGETS: dict[str, RetentionTarget] = {
+    # Only terminal rows: queued logs may still be picked up by the email worker.
+    "email_logs": RetentionTarget("email_logs", "created_at", "status in ('sent', 'failed')"),
+    "uc_email_otps": RetentionTarget("uc_email_otps", "expires_at"),
+}
+
+
+@dataclass
+class RetentionConfig:
+    tables: list[str]
+    email_logs_days: int = 90
+    otp_grace_hours: int = 24
+    batch_size: int = 1000
+    sleep_ms: int = 100
+    lock_timeout_ms: int = 2000
+    statement_timeout_ms: int = 15000
+    max_replica_lag_s: float = 10.0
+    max_batches: int = 0
+    max_retries: int = 10
+    archive_dir: str = ""
+    dry_run: bool = False
+    vacuum: bool = False
+    reindex: bool = False
+
+    @classmethod
+    def from_env(cls) -> "RetentionConfig":
+        tables = [t.strip() for t in (os.getenv("RETENTION_TABLES") or "").split(",") if t.strip()]
+        unknown = [t for t in tables if t not in TARGETS]
+        if unknown:
+            raise RuntimeError(f"Unknown RETENTION_TABLES entries: {', '.join(unknown)}")
+        return cls(
+            tables=tables or list(TARGETS.keys()),
+            email_logs_days=_env_int("RETENTION_EMAIL_LOGS_DAYS", 90),
+            otp_grace_hours=_env_int("RETENTION_OTP_GRACE_HOURS", 24),
+            batch_size=max(1, _env_int("RETENTION_BATCH_SIZE", 1000)),
+            sleep_ms=max(0, _env_int("RETENTION_SLEEP_MS", 100)),
+            lock_timeout_ms=max(1, _env_int("RETENTION_LOCK_TIMEOUT_MS", 2000)),
+            statement_timeout_ms=max(1, _env_int("RETENTION_STATEMENT_TIMEOUT_MS", 15000)),
+            max_replica_lag_s=float(os.getenv("RETENTION_MAX_REPLICA_LAG_S") or "10"),
+            max_batches=max(0, _env_int("RETENTION_MAX_BATCHES", 0)),
+            max_retries=max(1, _env_int("RETENTION_MAX_RETRIES", 10)),
+            archive_dir=(os.getenv("RETENTION_ARCHIVE_DIR") or "").strip(),
+            dry_run=_env_flag("RETENTION_DRY_RUN"),
+            vacuum=_env_flag("RETENTION_VACUUM"),
+            reindex=_env_flag("RETENTION_REINDEX"),
+        )
+
+    def cutoff_for(self, table: str, now: datetime) -> datetime:
+        if table == "uc_email_otps":
+            return now - timedelta(hours=self.otp_grace_hours)
+        return now - timedelta(days=self.email_logs_days)
+
+
+@dataclass
+class RetentionStats:
+    table: str
+    deleted: int = 0
+    batches: int = 0
+    lock_timeouts: int = 0
+    statement_timeouts: int = 0
+    throttled_s: float = 0.0
+    elapsed_s: float = 0.0
+
+    @property
+    def rows_per_s(self) -> float:
+        return self.deleted / self.elapsed_s if self.elapsed_s > 0 else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.table}: deleted={self.deleted} batches={self.batches} "
+            f"rate={self.rows_per_s:.0f} rows/s lock_timeouts={self.lock_timeouts} "
+            f"statement_timeouts={self.statement_timeouts} "
+            f"throttled={self.throttled_s:.1f}s elapsed={self.elapsed_s:.1f}s"
+        )
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = (os.getenv(name) or "").strip()
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError as e:
+        raise RuntimeError(f"{name} must be an integer (got {raw!r})") from e
+
+
+def _env_flag(name: str) -> bool:
+    return (os.getenv(name) or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _pgcode(e: OperationalError) -> str | None:
+    # psycopg2 exposes SQLSTATE as pgcode; 55P03 = lock_not_available, 57014 = query_canceled.
+    return getattr(getattr(e, "orig", None), "pgcode", None)
+
+
+def _batch_sql(target: RetentionTarget, *, first: bool, archive: bool) -> str:
+    t, k = target.table, target.key_column
+    after = "" if first else f"and {k} >= :after_key and ({k}, id) > (:after_key, :after_id)"
+    returning = "t.*" if archive else f"t.id, t.{k}"
+    return f"""
+        with batch as (
+          select id
+          from public.{t}
+          where {k} < :cutoff
+            and {target.where}
+            {after}
+          order by {k}, id
+          limit :limit
+          for update skip locked
+        )
+        , deleted as (
+          delete from public.{t} t
+          using batch
+          where t.id = batch.id
+          returning {returning}
+        )
+        -- Ordered so the last row is the keyset cursor under the server's own collation.
+        select * from deleted order by {k}, id
+    """
+
+
+class ReplicaLagProbe:
+    """
+    Reads max replay lag from pg_stat_replication. Without pg_monitor (or superuser) the view
+    still returns one row per standby, but with every column past application_name NULL, so
+    an unprivileged read looks exactly like "no lag". The probe checks `state` (never NULL for
+    a visible row) and disables itself with a warning when standbys exist but are hidden, or
+    when the query fails. `replay_lag` alone can't tell: it also goes NULL on an idle,
+    caught-up standby.
+    """
+
+    def __init__(self, engine) -> None:
+        self._engine = engine
+        self.available = True
+
+    def lag_seconds(self) -> float:
+        if not self.available:
+            return 0.0
+        try:
+            with self._engine.connect() as conn:
+                standbys, visible, lag = conn.execute(
+                    text(
+                        "select count(*), count(state), coalesce(max(extract(epoch from replay_lag)), 0) "
+                        "from pg_stat_replication"
+                    )
+                ).one()
+        except SQLAlchemyError as e:
+            self.available = False
+            print(f"[retention] Replica lag unavailable ({e.__class__.__name__}); lag throttling disabled.")
+            return 0.0
+        if standbys and not visible:
+            self.available = False
+            print(
+                f"[retention] WARNING: {standbys} standby(s) in pg_stat_replication but their stats are hidden "
+                "(grant pg_monitor); lag throttling disabled."
+            )
+            return 0.0
+        return float(lag or 0)
+
+
+class JsonlArchive:
+    def __init__(self, directory: str, table: str, started: datetime) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{table}-{started.strftime('%Y%m%dT%H%M%SZ')}.jsonl.gz")
+        self._fh = gzip.open(self.path, "at", encoding="utf-8")
+
+    def write(self, rows: list[dict[str, Any]]) -> None:
+        for row in rows:
+            self._fh.write(json.dumps(row, default=str, separators=(",", ":")))
+            self._fh.write("\n")
+        # Durable before the delete commits.
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+def count_eligible(engine, target: RetentionTarget, cutoff: datetime) -> int:
+    with engine.connect() as conn:
+        return int(
+            conn.execute(
+                text(f"select count(*) from public.{target.table} where {target.key_column} < :cutoff and {target.where}"),
+                {"cutoff": cutoff},
+            ).scalar()
+            or 0
+        )
+
+
+def purge_table(
+    engine,
+    target: RetentionTarget,
+    cfg: RetentionConfig,
+    *,
+    cutoff: datetime,
+    lag_probe: ReplicaLagProbe | None = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> RetentionStats:
+    stats = RetentionStats(target.table)
+    archive = JsonlArchive(cfg.archive_dir, target.table, datetime.now(timezone.utc)) if cfg.archive_dir else None
+    after: tuple[Any, Any] | None = None
+    backoff_s = max(cfg.sleep_ms / 1000.0, 0.5)
+    batch_size = cfg.batch_size
+    failures = 0
+    started = time.perf_counter()
+
+    try:
+        while not cfg.max_batches or stats.batches < cfg.max_batches:
+            params: dict[str, Any] = {"cutoff": cutoff, "limit": batch_size}
+            if after is not None:
+                params["after_key"], params["after_id"] = after
+            sql = text(_batch_sql(target, first=after is None, archive=archive is not None))
+
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(f"set local lock_timeout = {int(cfg.lock_timeout_ms)}"))
+                    conn.execute(text(f"set local statement_timeout = {int(cfg.statement_timeout_ms)}"))
+                    rows = [dict(r._mapping) for r in conn.execute(sql, params)]
+                    if archive is not None and rows:
+                        archive.write(rows)
+            except OperationalError as e:
+                code = _pgcode(e)
+                if code not in ("55P03", "57014"):
+                    raise
+                failures += 1
+                if failures > cfg.max_retries:
+                    raise RuntimeError(
+                        f"{target.table}: {failures} consecutive timed-out batches (last: {code}); giving up"
+                    ) from e
+                if code == "57014":
+                    # The batch itself is too slow; waiting won't help, a smaller one might.
+                    stats.statement_timeouts += 1
+                    batch_size = max(1, batch_size // 2)
+                    print(f"[retention] {target.table}: statement timeout; batch size now {batch_size}")
+                else:
+                    stats.lock_timeouts += 1
+                    sleep(backoff_s)
+                    backoff_s = min(backoff_s * 2, 30.0)
+                continue
+
+            failures = 0
+            backoff_s = max(cfg.sleep_ms / 1000.0, 0.5)
+            if not rows:
+                break
+
+            stats.batches += 1
+            stats.deleted += len(rows)
+            after = (rows[-1][target.key_column], rows[-1]["id"])
+
+            if stats.batches % 50 == 0:
+                stats.elapsed_s = time.perf_counter() - started
+                print(f"[retention] {stats.summary()}")
+
+            if lag_probe is not None and cfg.max_replica_lag_s > 0:
+                while (lag := lag_probe.lag_seconds()) > cfg.max_replica_lag_s:
+                    print(f"[retention] {target.table}: replica lag {lag:.1f}s > {cfg.max_replica_lag_s:.1f}s; pausing")
+                    pause = min(max(lag, 1.0), 30.0)
+                    sleep(pause)
+                    stats.throttled_s += pause
+            if cfg.sleep_ms:
+                sleep(cfg.sleep_ms / 1000.0)
+    finally:
+        if archive is not None:
+            archive.close()
+            if stats.deleted:
+                print(f"[retention] {target.table}: archived {stats.deleted} rows to {archive.path}")
+
+    stats.elapsed_s = time.perf_counter() - started
+    return stats
+
+
+def compact_table(engine, target: RetentionTarget, *, vacuum: bool, reindex: bool) -> None:
+    """
+    Reclaim space without exclusive locks: plain VACUUM takes SHARE UPDATE EXCLUSIVE and
+    REINDEX CONCURRENTLY (PG12+) builds the new index alongside the old one.
+    Both must run outside a transaction block.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("set lock_timeout = 5000"))
+        if vacuum:
+            print(f"[retention] {target.table}: vacuum analyze")
+            conn.execute(text(f"vacuum (analyze) public.{target.table}"))
+        if reindex:
+            print(f"[retention] {target.table}: reindex concurrently")
+            try:
+                conn.execute(text(f"reindex table concurrently public.{target.table}"))
+            except SQLAlchemyError:
+                _drop_invalid_reindex_leftovers(conn, target.table)
+                raise
+
+
+def _drop_invalid_reindex_leftovers(conn, table: str) -> None:
+    """
+    An interrupted REINDEX CONCURRENTLY leaves invalid `*_ccnew*` (or `*_ccold*`) indexes that
+    are still maintained on every write. Drop them; print whatever could not be dropped.
+    """
+    names = conn.execute(
+        text(
+            """
+            select quote_ident(n.nspname) || '.' || quote_ident(c.relname)
+            from pg_index i
+            join pg_class c on c.oid = i.indexrelid
+            join pg_namespace n on n.oid = c.relnamespace
+            where i.indrelid = cast(:table as regclass) and not i.indisvalid
+              and (c.relname like '%\\_ccnew%' or c.relname like '%\\_ccold%')
+            """
+        ),
+        {"table": f"public.{table}"},
+    ).scalars().all()
+    for name in names:
+        try:
+            conn.execute(text(f"drop index concurrently if exists {name}"))
+            print(f"[retention] {table}: dropped invalid index {name} left by the failed reindex")
+        except SQLAlchemyError as e:
+            print(f"[retention] {table}: could not drop invalid index {name} ({e.__class__.__name__}); drop it manually")
+
+
+def main() -> int:
+    try:
+        cfg = RetentionConfig.from_env()
+        engine, loaded_files = get_engine_from_env()
+        if loaded_files:
+            print(f"Loaded env from: {', '.join(loaded_files)}")
+    except Exception as e:
+        print(f"[retention] Failed to load config / create engine: {e.__class__.__name__}: {e}")
+        return 2
+
+    now = datetime.now(timezone.utc)
+    lag_probe = ReplicaLagProbe(engine) if cfg.max_replica_lag_s > 0 else None
+
+    try:
+        for name in cfg.tables:
+            target = TARGETS[name]
+            cutoff = cfg.cutoff_for(name, now)
+            if cfg.dry_run:
+                n = count_eligible(engine, target, cutoff)
+                print(f"[retention] {name}: {n} rows eligible (cutoff {cutoff.isoformat()}); dry run, nothing deleted")
+                continue
+
+            stats = purge_table(engine, target, cfg, cutoff=cutoff, lag_probe=lag_probe)
+            print(f"[retention] done {stats.summary()}")
+            if stats.deleted and (cfg.vacuum or cfg.reindex):
+                compact_table(engine, target, vacuum=cfg.vacuum, reindex=cfg.reindex)
+        return 0
+    except SQLAlchemyError as e:
+        print(f"[retention] DB error: {e.__class__.__name__}: {e}")
+        return 1
+    except Exception as e:
+        print(f"[retention] Unexpected error: {e.__class__.__name__}: {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
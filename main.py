@@ -1,15 +1,102 @@
 from __future__ import annotations
 
+import json
 import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
 from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from urllib.parse import parse_qs, urlparse
 
+from profiling import AllocationTracer, RequestProfiler, check_admin_token, sample_stacks
+from static_files import StaticFiles
+
 
 ROOT = Path(__file__).resolve().parent
 LOGIN_HTML = ROOT / "templates" / "login.html"
 
+MAX_MATCH_BATCH = 500
+
+# /deals/match needs the DB; off by default so the login page runs without DB settings.
+DEALS_INDEX_ENABLED = os.getenv("DEALS_INDEX_ENABLED", "0").strip().lower() in ("1", "true", "yes", "on")
+
+STATIC = StaticFiles.from_env({"/css/": ROOT / "css", "/static/": ROOT / "static"})
+
+# Environment as launched, before any dotenv loading mutates it. A reloaded process starts
+# from this so edited .env files win over values the old process had already loaded.
+_BOOT_ENV = dict(os.environ)
+
+REQUEST_PROFILER = RequestProfiler.from_env(str(ROOT))
+ALLOCATIONS = AllocationTracer()
+
+_deals_lock = threading.Lock()
+_deals_index = None
+_deals_loader: threading.Thread | None = None
+_deals_error = "starting"
+
+
+def _load_deals_index() -> None:
+    """
+    Build the deals index off the request path, retrying with back-off until it succeeds.
+    Requests get 503 until then; the engine is disposed after every failed attempt.
+    """
+    global _deals_index, _deals_error
+    try:
+        from database_setup import get_engine_from_env
+        from deals_index import DealsIndex, DealsIndexRefresher
+    except ImportError as e:
+        _deals_error = e.__class__.__name__
+        print(f"Deals index disabled: {e.__class__.__name__}: {e}")
+        return
+
+    retry_s = 5.0
+    while True:
+        engine = None
+        try:
+            engine, _ = get_engine_from_env(interactive=False)
+            index = DealsIndex()
+            index.refresh(engine, full=True)
+        except Exception as e:
+            _deals_error = e.__class__.__name__
+            print(f"Deals index load failed ({e.__class__.__name__}: {e}); retrying in {retry_s:.0f}s")
+            if engine is not None:
+                engine.dispose()
+            time.sleep(retry_s)
+            retry_s = min(retry_s * 2, 300.0)
+            continue
+        DealsIndexRefresher(
+            index,
+            engine,
+            interval_s=float(os.getenv("DEALS_INDEX_REFRESH_S", "30")),
+            full_every_s=float(os.getenv("DEALS_INDEX_FULL_REBUILD_S", "3600")),
+            safety_lag_s=float(os.getenv("DEALS_INDEX_SAFETY_LAG_S", "60")),
+        ).start()
+        _deals_index = index
+        return
+
+
+def _get_deals_index():
+    """
+    The deals index, or None while it is still loading (or when DEALS_INDEX_ENABLED is off).
+    Starts the loader on first call; imports stay lazy so the login page keeps working without
+    DB dependencies.
+    """
+    global _deals_loader
+    if not DEALS_INDEX_ENABLED:
+        return None
+    if _deals_index is None:
+        with _deals_lock:
+            if _deals_loader is None:
+                _deals_loader = threading.Thread(target=_load_deals_index, name="deals-index-load", daemon=True)
+                _deals_loader.start()
+    return _deals_index
+
 
 class AppHandler(BaseHTTPRequestHandler):
     server_version = "UnityCreditPython/1.0"
@@ -23,28 +110,141 @@ class AppHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(data)
 
+    def _send_text(self, text: str, *, status: int = HTTPStatus.OK) -> None:
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, payload: dict, *, status: int = HTTPStatus.OK) -> None:
+        data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(data)
+
     def _redirect(self, location: str) -> None:
         self.send_response(HTTPStatus.FOUND)
         self.send_header("Location", location)
         self.end_headers()
 
+    def _profile_label(self) -> str:
+        # Evaluated after the request ran; attributes are missing if the request line never parsed.
+        return f"{getattr(self, 'command', '')}-{urlparse(getattr(self, 'path', '')).path}"
+
+    def handle_one_request(self) -> None:
+        with REQUEST_PROFILER.maybe_profile(self._profile_label):
+            super().handle_one_request()
+
+    def _debug(self, path: str) -> None:
+        # Pretend the debug surface does not exist unless an admin token is configured and supplied.
+        if not check_admin_token(self.headers):
+            self.send_error(HTTPStatus.NOT_FOUND, "Not Found")
+            return
+        query = parse_qs(urlparse(self.path).query)
+        try:
+            if path == "/debug/profile":
+                seconds = float(query.get("seconds", ["5"])[0])
+                hz = float(query.get("hz", ["100"])[0])
+                return self._send_text(sample_stacks(seconds, hz=hz))
+            if path == "/debug/tracemalloc":
+                action = query.get("action", ["snapshot"])[0]
+                limit = int(query.get("limit", ["25"])[0])
+                frames = int(query.get("frames", ["10"])[0])
+                return self._send_text(ALLOCATIONS.handle(action, limit=limit, frames=frames))
+        except ValueError as e:
+            return self._send_text(f"{e}\n", status=HTTPStatus.BAD_REQUEST)
+        self.send_error(HTTPStatus.NOT_FOUND, "Not Found")
+
     def do_GET(self) -> None:
         path = urlparse(self.path).path
 
+        if path.startswith("/debug/"):
+            return self._debug(path)
+
         if path == "/":
             return self._redirect("/login")
 
         if path == "/login":
-            if not LOGIN_HTML.exists():
+            # Served from the cached descriptor via sendfile; no per-request read/encode.
+            if not STATIC.serve(self, str(LOGIN_HTML), cache_control="no-store"):
                 return self._send_html(
                     "<h1>Missing templates/login.html</h1>", status=HTTPStatus.INTERNAL_SERVER_ERROR
                 )
-            return self._send_html(LOGIN_HTML.read_text(encoding="utf-8"))
+            return None
+
+        if self._serve_static(path):
+            return None
+
+        if path == "/deals/match":
+            query = parse_qs(urlparse(self.path).query)
+            opts = {k: (query.get(k, [""])[0] or "") for k in ("kind", "category", "limit", "top")}
+            return self._deals_match(query.get("merchant", []), opts)
 
         self.send_error(HTTPStatus.NOT_FOUND, "Not Found")
 
+    def _serve_static(self, path: str, *, head: bool = False) -> bool:
+        file_path = STATIC.resolve(path)
+        return file_path is not None and STATIC.serve(self, file_path, head=head)
+
+    def do_HEAD(self) -> None:
+        path = urlparse(self.path).path
+        if path == "/login" and STATIC.serve(self, str(LOGIN_HTML), head=True, cache_control="no-store"):
+            return
+        if self._serve_static(path, head=True):
+            return
+        self.send_error(HTTPStatus.NOT_FOUND, "Not Found")
+
+    def _deals_match(self, merchants: list, opts: dict) -> None:
+        if not DEALS_INDEX_ENABLED:
+            return self.send_error(HTTPStatus.NOT_FOUND, "Not Found")
+        if not isinstance(merchants, list) or not merchants:
+            return self._send_json({"ok": False, "error": "Provide at least one merchant"}, status=HTTPStatus.BAD_REQUEST)
+        if len(merchants) > MAX_MATCH_BATCH:
+            return self._send_json(
+                {"ok": False, "error": f"At most {MAX_MATCH_BATCH} merchants per request"}, status=HTTPStatus.BAD_REQUEST
+            )
+        try:
+            limit = max(1, min(int(opts.get("limit") or 3), 20))
+            top = max(0, min(int(opts.get("top") or 0), 20))
+        except (TypeError, ValueError):
+            return self._send_json({"ok": False, "error": "limit/top must be integers"}, status=HTTPStatus.BAD_REQUEST)
+
+        index = _get_deals_index()
+        if index is None:
+            return self._send_json(
+                {"ok": False, "error": f"Deals index not ready ({_deals_error})"},
+                status=HTTPStatus.SERVICE_UNAVAILABLE,
+            )
+
+        kind = str(opts.get("kind") or "").strip() or None
+        category = str(opts.get("category") or "").strip() or None
+        batch = index.match_many([str(m) for m in merchants], kind=kind, category=category, limit=limit)
+        results = []
+        for merchant, matches in zip(merchants, batch):
+            item = {"merchant": merchant, "matches": [dict(row.to_json(), score=score) for row, score in matches]}
+            if top and matches:
+                item["top_in_category"] = [r.to_json() for r in index.top_deals(matches[0][0].category, top)]
+            results.append(item)
+        return self._send_json({"ok": True, "results": results})
+
     def do_POST(self) -> None:
         path = urlparse(self.path).path
+        if path == "/deals/match":
+            length = int(self.headers.get("Content-Length", "0") or "0")
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                return self._send_json({"ok": False, "error": "Invalid JSON body"}, status=HTTPStatus.BAD_REQUEST)
+            if not isinstance(body, dict):
+                body = {}
+            return self._deals_match(body.get("merchants") or [], body)
+
         if path != "/login":
             self.send_error(HTTPStatus.NOT_FOUND, "Not Found")
             return
@@ -78,15 +278,153 @@ class AppHandler(BaseHTTPRequestHandler):
         return
 
 
+class AppServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer that can adopt an inherited listening socket and count in-flight requests."""
+
+    def __init__(self, address, handler, *, listen_fd: int | None = None) -> None:
+        if listen_fd is None:
+            super().__init__(address, handler)
+        else:
+            super().__init__(address, handler, bind_and_activate=False)
+            self.socket.close()
+            self.socket = socket.socket(fileno=listen_fd)
+            self.server_address = self.socket.getsockname()
+            self.server_name = socket.getfqdn(self.server_address[0])
+            self.server_port = self.server_address[1]
+        self._inflight = 0
+        self._idle = threading.Condition()
+
+    def process_request(self, request, client_address) -> None:
+        # Counted before the worker thread starts, so a drain never misses an accepted request.
+        with self._idle:
+            self._inflight += 1
+        super().process_request(request, client_address)
+
+    def process_request_thread(self, request, client_address) -> None:
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            with self._idle:
+                self._inflight -= 1
+                self._idle.notify_all()
+
+    def wait_idle(self, timeout_s: float) -> bool:
+        deadline = time.monotonic() + timeout_s
+        with self._idle:
+            while self._inflight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+
+def _successor_env(listen_fd: int, ready_fd: int | None = None) -> dict[str, str]:
+    env = dict(_BOOT_ENV, UC_LISTEN_FD=str(listen_fd))
+    env.pop("UC_READY_FD", None)
+    if ready_fd is not None:
+        env["UC_READY_FD"] = str(ready_fd)
+    return env
+
+
+def _spawn_successor(httpd: AppServer, timeout_s: float) -> bool:
+    """
+    Start a fresh copy of this server on the same listening socket and wait until it reports
+    ready. Both processes accept on the socket until the old one stops, so nothing is refused.
+    """
+    listen_fd = httpd.socket.fileno()
+    os.set_inheritable(listen_fd, True)
+    r, w = os.pipe()
+    try:
+        subprocess.Popen(
+            [sys.executable, *sys.argv], env=_successor_env(listen_fd, w), pass_fds=(listen_fd, w), close_fds=True
+        )
+    except OSError as e:
+        print(f"Reload failed to start new process: {e}")
+        os.close(r)
+        os.close(w)
+        return False
+    os.close(w)
+    try:
+        ready, _, _ = select.select([r], [], [], timeout_s)
+        return bool(ready) and os.read(r, 1) == b"1"
+    finally:
+        os.close(r)
+
+
 def main() -> None:
     port = int(os.getenv("PORT", "8000"))
     host = os.getenv("HOST", "127.0.0.1")
+    drain_s = float(os.getenv("SHUTDOWN_DRAIN_S", "25"))
+    # exec (default): drain, then re-exec in place. Same PID, so systemd, Docker (PID 1) and
+    # supervisord keep tracking the service; new connections wait in the listen backlog meanwhile.
+    # spawn: the new process runs alongside until ready, then the old one exits (no gap). The
+    # successor is a child of the exiting process, so only use it when nothing supervises the PID
+    # (nohup, a terminal, a plain shell script); under a supervisor the service is marked dead or
+    # its cgroup killed, successor included.
+    reload_mode = os.getenv("RELOAD_MODE", "exec").strip().lower()
+
+    inherited = os.getenv("UC_LISTEN_FD")
+    httpd = AppServer((host, port), AppHandler, listen_fd=int(inherited) if inherited else None)
+    host, port = httpd.server_address[:2]
+
+    ready_fd = os.getenv("UC_READY_FD")
+    if ready_fd:
+        os.write(int(ready_fd), b"1")
+        os.close(int(ready_fd))
+
+    state = {"action": None}
+    reloading = threading.Lock()
+
+    def _stop(action: str) -> None:
+        state["action"] = action
+        # shutdown() blocks until serve_forever() returns, and the signal handler runs on that same thread.
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    def _on_term(signum, frame) -> None:
+        _stop("term")
+
+    def _reload() -> None:
+        if not reloading.acquire(blocking=False):
+            return
+        try:
+            if reload_mode == "exec":
+                _stop("exec")
+                return
+            if _spawn_successor(httpd, float(os.getenv("RELOAD_READY_TIMEOUT_S", "15"))):
+                print(f"Reload: new process is serving; draining pid {os.getpid()}")
+                _stop("handoff")
+            else:
+                print("Reload: new process did not become ready; keeping current process")
+        finally:
+            reloading.release()
+
+    def _on_hup(signum, frame) -> None:
+        threading.Thread(target=_reload, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _on_term)
+    signal.signal(signal.SIGINT, _on_term)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, _on_hup)
+
+    if DEALS_INDEX_ENABLED:
+        _get_deals_index()
 
-    httpd = ThreadingHTTPServer((host, port), AppHandler)
     print(f"Serving login page on http://{host}:{port}/login")
     httpd.serve_forever()
 
+    if state["action"] != "exec":
+        # Stop accepting; in a handoff the successor holds its own copy of the socket.
+        httpd.socket.close()
+    if not httpd.wait_idle(drain_s):
+        print(f"Drain deadline ({drain_s:.0f}s) reached with requests still in flight")
+
+    if state["action"] == "exec":
+        # Pending connections wait in the listen backlog while the new image starts.
+        listen_fd = httpd.socket.fileno()
+        os.set_inheritable(listen_fd, True)
+        os.execve(sys.executable, [sys.executable, *sys.argv], _successor_env(listen_fd))
+
 
 if __name__ == "__main__":
     main()
-
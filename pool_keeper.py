@@ -0,0 +1,226 @@
+"""
+Warm connection pool with background liveness checks.
+
+`pool_pre_ping=True` costs a `SELECT 1` round trip on every checkout, and a fresh process
+still pays TCP + TLS + auth on its first requests. PoolKeeper moves both off the request
+path:
+
+- start() opens DB_POOL_MIN connections concurrently before the first request.
+- A daemon thread wakes every DB_POOL_VALIDATE_S, cycles through the idle connections holding
+  one at a time, and
+    * closes those older than their lifetime (server-side timeouts, failovers, DNS moves),
+    * pings those idle longer than the validation interval, invalidating any that fail,
+    * reconnects what it closed as the record comes round again, still one at a time,
+    * tops the pool back up to DB_POOL_MIN.
+  Connections used recently are known-good and are not pinged. The rest of the pool stays
+  available to requests throughout.
+- Each connection's lifetime is DB_POOL_MAX_LIFETIME_S minus up to 20% random jitter, so
+  connections opened together by start() don't all expire in the same cycle.
+- engine.dispose() stops the thread.
+- The engine keeps `pool_recycle` as a backstop in case the thread falls behind.
+
+Usage:
+  engine, _ = get_engine_from_env(keep_warm=True)   # see database_setup.py
+  python pool_keeper.py                             # cold-start / per-query benchmark
+
+Env (all optional):
+  DB_POOL_SIZE            pool_size (default: 5)
+  DB_POOL_MIN             connections kept open and warm (default: 2)
+  DB_POOL_VALIDATE_S      background check interval (default: 30)
+  DB_POOL_MAX_LIFETIME_S  recycle connections older than this (default: 1800)
+"""
+
+from __future__ import annotations
+
+import os
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event, text
+
+LIFETIME_JITTER = 0.2
+
+
+def pool_settings_from_env() -> dict[str, float]:
+    return {
+        "pool_size": max(1, int(os.getenv("DB_POOL_SIZE") or "5")),
+        "min_idle": max(0, int(os.getenv("DB_POOL_MIN") or "2")),
+        "validate_s": max(1.0, float(os.getenv("DB_POOL_VALIDATE_S") or "30")),
+        "max_lifetime_s": max(60.0, float(os.getenv("DB_POOL_MAX_LIFETIME_S") or "1800")),
+    }
+
+
+class PoolKeeper:
+    def __init__(self, engine, *, min_idle: int = 2, validate_s: float = 30.0, max_lifetime_s: float = 1800.0) -> None:
+        self.engine = engine
+        self.min_idle = min_idle
+        self.validate_s = validate_s
+        self.max_lifetime_s = max_lifetime_s
+        self.stats = {"opened": 0, "pinged": 0, "evicted_stale": 0, "evicted_age": 0, "reconnected": 0}
+        self._pass = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="db-pool-keeper", daemon=True)
+
+        @event.listens_for(engine, "connect")
+        def _on_connect(dbapi_conn, record) -> None:
+            now = time.monotonic()
+            record.info["uc_expires"] = now + max_lifetime_s * (1.0 - random.uniform(0.0, LIFETIME_JITTER))
+            record.info["uc_last_used"] = now
+
+        @event.listens_for(engine, "checkin")
+        def _on_checkin(dbapi_conn, record) -> None:
+            # The keeper's own visits say nothing about liveness and must not postpone pings.
+            if record.info.pop("uc_keeper", False):
+                return
+            record.info["uc_last_used"] = time.monotonic()
+
+        @event.listens_for(engine, "engine_disposed")
+        def _on_dispose(_engine) -> None:
+            self.stop()
+
+    def start(self) -> "PoolKeeper":
+        self.warm()
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def warm(self) -> int:
+        """Open connections concurrently until min_idle are available."""
+        pool = self.engine.pool
+        missing = self.min_idle - pool.checkedin()
+        if missing <= 0:
+            return 0
+        # Hold every connection until all are open, otherwise the pool would hand the same one back.
+        with ThreadPoolExecutor(max_workers=missing) as ex:
+            fairies = list(ex.map(lambda _: pool.connect(), range(missing)))
+        for f in fairies:
+            f.close()
+        self.stats["opened"] += len(fairies)
+        return len(fairies)
+
+    def check_once(self) -> None:
+        pool = self.engine.pool
+        self._pass += 1
+        # QueuePool hands out idle connections FIFO and each goes to the back on return, so
+        # `checkedin()` checkouts visit every idle record once. A record invalidated on the way
+        # comes back empty and is reconnected here when the second lap reaches it; healthy
+        # records seen again are handed straight back. Only one is held at any time.
+        idle = pool.checkedin()
+        pending = 0
+        for visit in range(idle * 2):
+            if self._stop.is_set() or (visit >= idle and pending <= 0):
+                return
+            fairy = pool.connect()
+            info = fairy.info
+            if info.get("uc_pass") == self._pass:
+                info["uc_keeper"] = True
+                fairy.close()
+                continue
+            if visit >= idle:
+                # Not seen this pass, so it is a record we emptied and checkout just reconnected.
+                pending -= 1
+                self.stats["reconnected"] += 1
+            info["uc_pass"] = self._pass
+            # invalidate() already releases the connection; close() is only for healthy ones.
+            if not self._check_connection(fairy):
+                pending += 1
+                continue
+            info["uc_keeper"] = True
+            fairy.close()
+        self.warm()
+
+    def _check_connection(self, fairy) -> bool:
+        info = fairy.info
+        now = time.monotonic()
+        if now >= info.get("uc_expires", now + self.max_lifetime_s):
+            fairy.invalidate()
+            self.stats["evicted_age"] += 1
+            return False
+        if now - info.get("uc_last_used", now) < self.validate_s:
+            return True
+        try:
+            cur = fairy.cursor()
+            cur.execute("select 1")
+            cur.fetchall()
+            cur.close()
+        except Exception:
+            fairy.invalidate()
+            self.stats["evicted_stale"] += 1
+            return False
+        self.stats["pinged"] += 1
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.validate_s):
+            try:
+                self.check_once()
+            except Exception as e:
+                print(f"[pool_keeper] Check failed: {e.__class__.__name__}: {e}")
+
+
+def start_pool_keeper(engine, settings: dict[str, float] | None = None) -> PoolKeeper:
+    s = settings or pool_settings_from_env()
+    # Never ask for more warm connections than the pool can hold without overflow.
+    return PoolKeeper(
+        engine,
+        min_idle=min(int(s["min_idle"]), int(s["pool_size"])),
+        validate_s=s["validate_s"],
+        max_lifetime_s=s["max_lifetime_s"],
+    ).start()
+
+
+def _time_queries(engine, n: int) -> list[float]:
+    out = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        with engine.connect() as conn:
+            conn.execute(text("select 1"))
+        out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+
+def main() -> int:
+    from database_setup import create_db_engine, get_engine_from_env
+
+    try:
+        probe, loaded_files = get_engine_from_env()
+        probe.dispose()
+        if loaded_files:
+            print(f"Loaded env from: {', '.join(loaded_files)}")
+    except Exception as e:
+        print(f"[pool_keeper] Failed to load DB env: {e.__class__.__name__}: {e}")
+        return 2
+
+    n = int(os.getenv("POOL_BENCH_QUERIES") or "200")
+    s = pool_settings_from_env()
+    try:
+        pre_ping = create_db_engine()
+        cold = _time_queries(pre_ping, 1)[0]
+        steady = _time_queries(pre_ping, n)
+        pre_ping.dispose()
+
+        kept = create_db_engine(pre_ping=False, pool_size=int(s["pool_size"]), pool_recycle=int(s["max_lifetime_s"] * 2))
+        keeper = start_pool_keeper(kept, s)
+        warm_first = _time_queries(kept, 1)[0]
+        kept_steady = _time_queries(kept, n)
+        keeper.stop()
+        kept.dispose()
+    except Exception as e:
+        print(f"[pool_keeper] Benchmark failed: {e.__class__.__name__}: {e}")
+        return 1
+
+    print(f"[pool_keeper] first query: pre_ping cold={cold:.2f}ms  keeper warm={warm_first:.2f}ms")
+    print(
+        f"[pool_keeper] per query ({n}): pre_ping median={statistics.median(steady):.2f}ms "
+        f"keeper median={statistics.median(kept_steady):.2f}ms"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
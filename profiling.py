@@ -0,0 +1,169 @@
+"""
+Opt-in profiling hooks for `main.py`.
+
+Everything here is off unless configured; when off, the per-request cost is one attribute
+check. Endpoints are only served when DEBUG_ADMIN_TOKEN is set and the caller sends it
+(`X-Admin-Token: <token>` or `Authorization: Bearer <token>`); otherwise they 404.
+
+- `/debug/profile?seconds=N[&hz=H]` samples every thread's stack via sys._current_frames()
+  and returns collapsed stacks (`frame;frame;frame count`) ready for flamegraph.pl / speedscope.
+- `/debug/tracemalloc?action=start|snapshot|diff|stop[&limit=N]` controls tracemalloc:
+  `snapshot` stores a baseline and returns top allocation sites, `diff` compares against it.
+- PROFILE_SAMPLE_RATE (0..1) + PROFILE_DIR: cProfile a random fraction of requests and write
+  `<dir>/<ts>.<ms>-<pid>-<seq>-<method>-<path>.prof` (open with `python -m pstats` or snakeviz).
+
+Env:
+  DEBUG_ADMIN_TOKEN     enables /debug/* (unset = disabled)
+  PROFILE_SAMPLE_RATE   fraction of requests to cProfile (default: 0)
+  PROFILE_DIR           output directory for .prof files (default: ./profiles)
+"""
+
+from __future__ import annotations
+
+import cProfile
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Iterator
+
+MAX_PROFILE_SECONDS = 60
+_SAFE_NAME = re.compile(r"[^A-Za-z0-9_.-]+")
+_DISABLED = nullcontext()
+
+
+def check_admin_token(headers) -> bool:
+    expected = (os.getenv("DEBUG_ADMIN_TOKEN") or "").strip()
+    if not expected:
+        return False
+    supplied = (headers.get("X-Admin-Token") or "").strip()
+    if not supplied:
+        auth = (headers.get("Authorization") or "").strip()
+        if auth.lower().startswith("bearer "):
+            supplied = auth[7:].strip()
+    return bool(supplied) and hmac.compare_digest(supplied.encode("utf-8"), expected.encode("utf-8"))
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+def sample_stacks(seconds: float, *, hz: float = 100.0) -> str:
+    """Sample all threads except the caller for `seconds` and return collapsed stacks."""
+    seconds = max(0.1, min(float(seconds), MAX_PROFILE_SECONDS))
+    interval = 1.0 / max(1.0, min(float(hz), 1000.0))
+    me = threading.get_ident()
+    names = {}
+    counts: Counter[str] = Counter()
+
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for t in threading.enumerate():
+            names[t.ident] = t.name
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+
+    return "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
+
+
+class AllocationTracer:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._baseline: tracemalloc.Snapshot | None = None
+
+    def handle(self, action: str, *, limit: int = 25, frames: int = 10) -> str:
+        limit = max(1, min(limit, 500))
+        with self._lock:
+            if action == "start":
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(max(1, min(frames, 50)))
+                self._baseline = None
+                return "tracemalloc started\n"
+            if action == "stop":
+                tracemalloc.stop()
+                self._baseline = None
+                return "tracemalloc stopped\n"
+            if not tracemalloc.is_tracing():
+                raise ValueError("tracemalloc is not running; call action=start first")
+
+            snap = tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>"))
+            )
+            current, peak = tracemalloc.get_traced_memory()
+            header = f"traced current={current} peak={peak}\n"
+            if action == "snapshot":
+                self._baseline = snap
+                return header + "".join(f"{s}\n" for s in snap.statistics("lineno")[:limit])
+            if action == "diff":
+                if self._baseline is None:
+                    raise ValueError("No baseline; call action=snapshot first")
+                stats = snap.compare_to(self._baseline, "lineno")
+                return header + "".join(f"{s}\n" for s in stats[:limit])
+        raise ValueError(f"Unknown action: {action}")
+
+
+class RequestProfiler:
+    """cProfile a random fraction of requests. Only one request is profiled at a time."""
+
+    def __init__(self, rate: float, directory: str) -> None:
+        self.rate = max(0.0, min(rate, 1.0))
+        self.directory = directory
+        self._busy = threading.Lock()
+        self._seq = 0
+
+    @classmethod
+    def from_env(cls, root: str) -> "RequestProfiler":
+        try:
+            rate = float(os.getenv("PROFILE_SAMPLE_RATE") or "0")
+        except ValueError:
+            rate = 0.0
+        return cls(rate, os.getenv("PROFILE_DIR") or os.path.join(root, "profiles"))
+
+    def maybe_profile(self, label: Callable[[], str]):
+        if self.rate <= 0 or random.random() >= self.rate:
+            return _DISABLED
+        return self._profile(label)
+
+    @contextmanager
+    def _profile(self, label: Callable[[], str]) -> Iterator[None]:
+        if not self._busy.acquire(blocking=False):
+            yield
+            return
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+            try:
+                yield
+            finally:
+                prof.disable()
+                self._dump(prof, label)
+        finally:
+            self._busy.release()
+
+    def _dump(self, prof: cProfile.Profile, label: Callable[[], str]) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            name = _SAFE_NAME.sub("_", label() or "request").strip("_")[:80]
+            # Called under _busy, so the counter needs no lock; the pid separates a reloaded
+            # server writing to the same directory.
+            self._seq += 1
+            now = time.time()
+            stamp = f"{time.strftime('%Y%m%dT%H%M%S', time.localtime(now))}.{int(now * 1000) % 1000:03d}"
+            prof.dump_stats(os.path.join(self.directory, f"{stamp}-{os.getpid()}-{self._seq}-{name}.prof"))
+        except OSError as e:
+            print(f"[profiling] Failed to write profile: {e.__class__.__name__}: {e}")
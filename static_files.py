@@ -0,0 +1,302 @@
+"""
+Static file serving for `main.py` (zero-copy where the OS allows it).
+
+- URL -> real path resolutions, open file descriptors and stat results are cached (LRU,
+  bounded) and re-validated at most every STATIC_STAT_TTL_S seconds, so a hot asset costs no
+  realpath()/open()/stat() per request.
+- Bodies go out with os.sendfile() straight from the page cache to the socket; platforms
+  without sendfile (Windows) fall back to a buffered copy.
+- Conditional requests (If-None-Match / If-Modified-Since -> 304) and single byte ranges
+  (Range / If-Range -> 206 / 416) are supported.
+- Fingerprinted names (`style.3f2a9c1b.css`) get `Cache-Control: public, max-age=31536000, immutable`;
+  everything else is `no-cache` (always revalidate, cheap thanks to the 304 path).
+- Requests are resolved against fixed roots and rejected if the real path escapes them.
+
+Env:
+  STATIC_STAT_TTL_S     seconds between re-stat of a cached file (default: 2)
+  STATIC_MAX_OPEN_FILES max cached descriptors (default: 256)
+"""
+
+from __future__ import annotations
+
+import mimetypes
+import os
+import re
+import select
+import stat
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
+from pathlib import Path
+from urllib.parse import unquote
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+_FINGERPRINT = re.compile(r"\.[0-9a-fA-F]{8,}\.[A-Za-z0-9]+$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_SENDFILE_CHUNK = 1 << 20
+
+
+class _Entry:
+    __slots__ = ("path", "fd", "size", "mtime", "key", "etag", "last_modified", "content_type", "checked_at", "refs", "evicted")
+
+    def __init__(self, path: str, fd: int, st: os.stat_result, content_type: str) -> None:
+        self.path = path
+        self.fd = fd
+        self.size = st.st_size
+        self.mtime = int(st.st_mtime)
+        self.key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        self.etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        self.last_modified = formatdate(st.st_mtime, usegmt=True)
+        self.content_type = content_type
+        self.checked_at = time.monotonic()
+        self.refs = 0
+        self.evicted = False
+
+
+class StaticFiles:
+    def __init__(self, roots: dict[str, Path], *, stat_ttl_s: float = 2.0, max_open: int = 256) -> None:
+        # URL prefix ("/css/") -> directory. Roots are resolved once so symlinked roots still work.
+        self.roots = {prefix: Path(os.path.realpath(d)) for prefix, d in roots.items()}
+        self.stat_ttl_s = stat_ttl_s
+        self.max_open = max(1, max_open)
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        # URL path -> (real path under a root, resolved_at). Only in-root results are kept.
+        self._resolved: OrderedDict[str, tuple[str, float]] = OrderedDict()
+
+    @classmethod
+    def from_env(cls, roots: dict[str, Path]) -> "StaticFiles":
+        return cls(
+            roots,
+            stat_ttl_s=float(os.getenv("STATIC_STAT_TTL_S") or "2"),
+            max_open=int(os.getenv("STATIC_MAX_OPEN_FILES") or "256"),
+        )
+
+    def resolve(self, url_path: str) -> str | None:
+        """
+        Map a URL path to a real path under one of the roots, or None. Whether the file exists
+        is left to serve(), which stats it through the descriptor cache anyway.
+        """
+        now = time.monotonic()
+        with self._lock:
+            hit = self._resolved.get(url_path)
+            if hit is not None and now - hit[1] < self.stat_ttl_s:
+                self._resolved.move_to_end(url_path)
+                return hit[0]
+
+        real = self._resolve_uncached(url_path)
+        if real is not None:
+            with self._lock:
+                self._resolved[url_path] = (real, now)
+                self._resolved.move_to_end(url_path)
+                while len(self._resolved) > self.max_open * 4:
+                    self._resolved.popitem(last=False)
+        return real
+
+    def _resolve_uncached(self, url_path: str) -> str | None:
+        for prefix, root in self.roots.items():
+            if not url_path.startswith(prefix):
+                continue
+            rel = unquote(url_path[len(prefix) :])
+            if not rel or "\x00" in rel or "\\" in rel:
+                return None
+            real = os.path.realpath(os.path.join(root, rel))
+            try:
+                if os.path.commonpath([real, str(root)]) != str(root):
+                    return None
+            except ValueError:
+                # Different drives on Windows.
+                return None
+            return real
+        return None
+
+    # --- descriptor cache -----------------------------------------------------------------
+
+    def _release(self, entry: _Entry) -> None:
+        with self._lock:
+            entry.refs -= 1
+            if entry.evicted and entry.refs == 0:
+                os.close(entry.fd)
+
+    def _evict_locked(self, entry: _Entry) -> None:
+        self._entries.pop(entry.path, None)
+        entry.evicted = True
+        if entry.refs == 0:
+            os.close(entry.fd)
+
+    def _acquire(self, path: str) -> _Entry | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and now - entry.checked_at < self.stat_ttl_s:
+                self._entries.move_to_end(path)
+                entry.refs += 1
+                return entry
+
+        # Stat (and maybe open) outside the lock; the file may have changed or vanished.
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                if st is not None and entry.key == (st.st_ino, st.st_size, st.st_mtime_ns):
+                    entry.checked_at = now
+                    self._entries.move_to_end(path)
+                    entry.refs += 1
+                    return entry
+                self._evict_locked(entry)
+        if st is None or not stat.S_ISREG(st.st_mode):
+            return None
+
+        try:
+            fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+            st = os.fstat(fd)
+        except OSError:
+            return None
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type in ("application/javascript", "application/json"):
+            content_type += "; charset=utf-8"
+        entry = _Entry(path, fd, st, content_type)
+
+        with self._lock:
+            existing = self._entries.get(path)
+            if existing is not None:
+                self._evict_locked(existing)
+            self._entries[path] = entry
+            while len(self._entries) > self.max_open:
+                self._evict_locked(next(iter(self._entries.values())))
+            entry.refs += 1
+        return entry
+
+    # --- HTTP -----------------------------------------------------------------------------
+
+    def serve(self, handler, path: str, *, head: bool = False, cache_control: str | None = None) -> bool:
+        """Send `path` on `handler`. Returns False (nothing sent) if the file cannot be opened."""
+        entry = self._acquire(path)
+        if entry is None:
+            return False
+        try:
+            self._send(handler, entry, head=head, cache_control=cache_control)
+        finally:
+            self._release(entry)
+        return True
+
+    def _not_modified(self, headers, entry: _Entry) -> bool:
+        inm = headers.get("If-None-Match")
+        if inm is not None:
+            # If-None-Match uses weak comparison: W/"x" matches "x".
+            return any(tag.strip().removeprefix("W/") in (entry.etag, "*") for tag in inm.split(","))
+        ims = headers.get("If-Modified-Since")
+        if ims:
+            try:
+                return entry.mtime <= int(parsedate_to_datetime(ims).timestamp())
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _byte_range(self, headers, entry: _Entry) -> tuple[int, int] | None | bool:
+        """(start, end) inclusive, None for full body, False if unsatisfiable."""
+        raw = (headers.get("Range") or "").strip()
+        if not raw:
+            return None
+        if_range = headers.get("If-Range")
+        if if_range and if_range.strip() not in (entry.etag, entry.last_modified):
+            return None
+        m = _RANGE.match(raw)
+        if not m:
+            # Multi-range or unknown units: ignoring Range and sending 200 is always allowed.
+            return None
+        first, last = m.groups()
+        size = entry.size
+        if not first:
+            if not last or int(last) == 0:
+                return False
+            return max(0, size - int(last)), size - 1
+        start = int(first)
+        if last and int(last) < start:
+            # Invalid range-spec (RFC 9110 14.2): ignore the header and send 200.
+            return None
+        if start >= size:
+            return False
+        end = min(int(last), size - 1) if last else size - 1
+        return start, end
+
+    def _send(self, handler, entry: _Entry, *, head: bool, cache_control: str | None) -> None:
+        if cache_control is None:
+            immutable = _FINGERPRINT.search(os.path.basename(entry.path))
+            cache_control = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+
+        def common_headers() -> None:
+            handler.send_header("ETag", entry.etag)
+            handler.send_header("Last-Modified", entry.last_modified)
+            handler.send_header("Cache-Control", cache_control)
+            handler.send_header("Accept-Ranges", "bytes")
+
+        if self._not_modified(handler.headers, entry):
+            handler.send_response(HTTPStatus.NOT_MODIFIED)
+            common_headers()
+            handler.end_headers()
+            return
+
+        rng = self._byte_range(handler.headers, entry)
+        if rng is False:
+            handler.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            handler.send_header("Content-Range", f"bytes */{entry.size}")
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+
+        if rng is None:
+            start, length = 0, entry.size
+            handler.send_response(HTTPStatus.OK)
+        else:
+            start, end = rng
+            length = end - start + 1
+            handler.send_response(HTTPStatus.PARTIAL_CONTENT)
+            handler.send_header("Content-Range", f"bytes {start}-{end}/{entry.size}")
+        handler.send_header("Content-Type", entry.content_type)
+        handler.send_header("Content-Length", str(length))
+        common_headers()
+        handler.end_headers()
+        if not head and length:
+            handler.wfile.flush()
+            _copy_to_socket(handler.connection, entry, start, length)
+
+
+def _copy_to_socket(sock, entry: _Entry, offset: int, count: int) -> None:
+    if not hasattr(os, "sendfile"):
+        # No sendfile (Windows): reopen so concurrent requests don't share a file position.
+        with open(entry.path, "rb") as fh:
+            fh.seek(offset)
+            remaining = count
+            while remaining > 0:
+                chunk = fh.read(min(remaining, 64 * 1024))
+                if not chunk:
+                    break
+                sock.sendall(chunk)
+                remaining -= len(chunk)
+        return
+
+    out_fd = sock.fileno()
+    timeout = sock.gettimeout()
+    while count > 0:
+        try:
+            sent = os.sendfile(out_fd, entry.fd, offset, min(count, _SENDFILE_CHUNK))
+        except BlockingIOError:
+            # Socket has a timeout (non-blocking under the hood): wait until writable.
+            _, writable, _ = select.select([], [out_fd], [], timeout)
+            if not writable:
+                raise TimeoutError("static file send timed out")
+            continue
+        if sent == 0:
+            break
+        offset += sent
+        count -= sent
+
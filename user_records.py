@@ -0,0 +1,195 @@
+"""
+Zero-ORM read path for `unity_users` and `users`.
+
+`check_user.py` used to build a dict per row and `create_admin.py` hydrated a full ORM `User`
+(identity map, change tracking) just to check one username. For read-only paths this module
+returns NamedTuple records straight from Core result rows:
+
+- UnityUserRecord / UserRecord: tuple-sized, attribute access, `_asdict()` when a dict is needed.
+- Statements are built once at import with bindparam() placeholders, so SQLAlchemy's
+  compiled-statement cache compiles each one once per engine/dialect.
+
+Usage:
+  python user_records.py     # benchmark ORM vs dict(_mapping) vs records
+
+Benchmark env:
+  USER_RECORDS_BENCH_SOURCE  sqlite (synthetic, default) | db (unity_users via get_engine_from_env)
+  USER_RECORDS_BENCH_ROWS    synthetic row count / max rows read from db (default: 100000)
+"""
+
+from __future__ import annotations
+
+import gc
+import os
+import time
+import tracemalloc
+from typing import Iterator, NamedTuple
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, bindparam, func, select
+
+from models import User
+
+
+class UnityUserRecord(NamedTuple):
+    id: int
+    username: str
+    hashed_password: str
+    is_active: bool
+
+
+class UserRecord(NamedTuple):
+    id: str
+    email: str | None
+    password_hash: str | None
+    email_verified_at: object | None
+
+
+unity_users = User.__table__
+
+# Prisma-managed `users` table (see prisma/schema.prisma); only the columns read here.
+users = Table(
+    "users",
+    MetaData(),
+    Column("id", String, primary_key=True),
+    Column("email", String),
+    Column("password_hash", String),
+    Column("email_verified_at", DateTime(timezone=True)),
+    Column("created_at", DateTime(timezone=True)),
+)
+
+_UNITY_COLS = (unity_users.c.id, unity_users.c.username, unity_users.c.hashed_password, unity_users.c.is_active)
+_USER_COLS = (users.c.id, users.c.email, users.c.password_hash, users.c.email_verified_at)
+
+UNITY_USER_BY_USERNAME = select(*_UNITY_COLS).where(unity_users.c.username == bindparam("username")).limit(1)
+UNITY_USERS_BY_LOWER_USERNAME = (
+    select(*_UNITY_COLS).where(func.lower(unity_users.c.username) == bindparam("username")).limit(bindparam("limit"))
+)
+UNITY_USERS_LATEST = select(*_UNITY_COLS).order_by(unity_users.c.id.desc()).limit(bindparam("limit"))
+UNITY_USERS_AFTER_ID = (
+    select(*_UNITY_COLS)
+    .where(unity_users.c.id > bindparam("after_id"))
+    .order_by(unity_users.c.id)
+    .limit(bindparam("limit"))
+)
+
+USERS_BY_LOWER_EMAIL = (
+    select(*_USER_COLS).where(func.lower(users.c.email) == bindparam("email")).limit(bindparam("limit"))
+)
+USERS_LATEST = select(*_USER_COLS).order_by(users.c.created_at.desc().nulls_last()).limit(bindparam("limit"))
+
+
+def get_unity_user(conn, username: str) -> UnityUserRecord | None:
+    """Exact (case-sensitive, index-backed) lookup used by auth paths."""
+    row = conn.execute(UNITY_USER_BY_USERNAME, {"username": username}).first()
+    return UnityUserRecord._make(row) if row is not None else None
+
+
+def find_unity_users(conn, username: str, *, limit: int = 20) -> list[UnityUserRecord]:
+    rs = conn.execute(UNITY_USERS_BY_LOWER_USERNAME, {"username": username.lower(), "limit": limit})
+    return list(map(UnityUserRecord._make, rs))
+
+
+def latest_unity_users(conn, *, limit: int = 20) -> list[UnityUserRecord]:
+    return list(map(UnityUserRecord._make, conn.execute(UNITY_USERS_LATEST, {"limit": limit})))
+
+
+def iter_unity_users(conn, *, chunk: int = 10_000) -> Iterator[UnityUserRecord]:
+    """All rows in keyset chunks by id; memory is bounded by `chunk`."""
+    after_id = 0
+    while True:
+        rs = conn.execute(UNITY_USERS_AFTER_ID, {"after_id": after_id, "limit": chunk})
+        batch = list(map(UnityUserRecord._make, rs))
+        if not batch:
+            return
+        yield from batch
+        after_id = batch[-1].id
+
+
+def find_users_by_email(conn, email: str, *, limit: int = 20) -> list[UserRecord]:
+    rs = conn.execute(USERS_BY_LOWER_EMAIL, {"email": email.lower(), "limit": limit})
+    return list(map(UserRecord._make, rs))
+
+
+def latest_users(conn, *, limit: int = 20) -> list[UserRecord]:
+    return list(map(UserRecord._make, conn.execute(USERS_LATEST, {"limit": limit})))
+
+
+def _measure(label: str, load) -> tuple[str, int, float, float]:
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    rows = load()
+    elapsed = time.perf_counter() - t0
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    n = len(rows)
+    del rows
+    return label, n, n / elapsed if elapsed > 0 else 0.0, current / n if n else 0.0
+
+
+def main() -> int:
+    from sqlalchemy import create_engine, insert
+    from sqlalchemy.orm import Session
+
+    source = (os.getenv("USER_RECORDS_BENCH_SOURCE") or "sqlite").strip().lower()
+    n = int(os.getenv("USER_RECORDS_BENCH_ROWS") or "100000")
+
+    if source == "db":
+        from database_setup import get_engine_from_env
+
+        try:
+            engine, loaded_files = get_engine_from_env()
+            if loaded_files:
+                print(f"Loaded env from: {', '.join(loaded_files)}")
+        except Exception as e:
+            print(f"[user_records] Failed to create engine: {e.__class__.__name__}: {e}")
+            return 2
+    else:
+        engine = create_engine("sqlite://")
+        User.metadata.create_all(engine)
+        with engine.begin() as conn:
+            rows = [
+                {"username": f"user{i}@example.com", "hashed_password": "pbkdf2_sha256$1$x$y", "is_active": True}
+                for i in range(n)
+            ]
+            conn.execute(insert(unity_users), rows)
+
+    orm_stmt = select(User).order_by(User.id).limit(n)
+    core_stmt = select(*_UNITY_COLS).order_by(unity_users.c.id).limit(n)
+
+    def load_orm():
+        with Session(engine) as session:
+            return list(session.scalars(orm_stmt))
+
+    def load_dicts():
+        with engine.connect() as conn:
+            return [dict(r._mapping) for r in conn.execute(core_stmt)]
+
+    def load_records():
+        with engine.connect() as conn:
+            return list(map(UnityUserRecord._make, conn.execute(core_stmt)))
+
+    # Warm-up so statement compilation and connection setup don't skew the first contender.
+    load_records()
+
+    print(f"[user_records] source={source}")
+    for label, count, rate, per_row in (
+        _measure("orm User", load_orm),
+        _measure("dict(_mapping)", load_dicts),
+        _measure("UnityUserRecord", load_records),
+    ):
+        print(f"  {label:<16} rows={count:<8} {rate:>10.0f} rows/s  {per_row:>7.0f} B/row")
+
+    with engine.connect() as conn:
+        probe = latest_unity_users(conn, limit=1)
+        if probe:
+            iters = 2000
+            t0 = time.perf_counter()
+            for _ in range(iters):
+                get_unity_user(conn, probe[0].username)
+            print(f"  auth lookup      {iters / (time.perf_counter() - t0):>10.0f} lookups/s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())